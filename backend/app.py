@@ -2,12 +2,21 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
-from extensions import db
+from extensions import cache, db, s3
+from jobs import upload_queue
+from metrics import metrics
+from routes.auth_routes import auth_bp
 from routes.file_routes import file_bp
-from models import File 
+from routes.job_routes import job_bp
+from usage import usage_cli
+from validator import get_auth_cache_stats
+from models import File, add_content_hash_column, widen_file_size_column
 
 load_dotenv()
 
+# Entries of get_auth_cache_stats that are current sizes rather than event counts
+AUTH_CACHE_SIZES = ('keys', 'tokens')
+
 def create_app():
     app = Flask(__name__)
     CORS(app) 
@@ -16,11 +25,31 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
     db.init_app(app)
-
+    s3.init_app(app)
+    cache.init_app(app)
+    upload_queue.init_app(app)
+    metrics.init_app(app)
+    metrics.register_collector('nimbus_cache_events', 'List cache hits, misses and errors.', cache.stats,
+                               kind='counter')
+    metrics.register_collector('nimbus_auth_cache_events', 'JWKS key and verified token cache counters.',
+                               lambda: {name: value for name, value in get_auth_cache_stats().items()
+                                        if name not in AUTH_CACHE_SIZES}, kind='counter')
+    metrics.register_collector('nimbus_auth_cache_entries', 'JWKS keys and verified tokens currently cached.',
+                               lambda: {name: value for name, value in get_auth_cache_stats().items()
+                                        if name in AUTH_CACHE_SIZES})
+    metrics.register_collector('nimbus_upload_queue', 'Jobs waiting in the async upload queue.',
+                               lambda: {'depth': upload_queue.depth()})
+
+    app.register_blueprint(auth_bp, url_prefix='/api')
     app.register_blueprint(file_bp, url_prefix='/api')
+    app.register_blueprint(job_bp, url_prefix='/api')
+    app.cli.add_command(usage_cli)
 
     with app.app_context():
         db.create_all()
+        widen_file_size_column()
+        add_content_hash_column()
+        upload_queue.recover()
 
     return app
 
@@ -0,0 +1,97 @@
+"""Compare page-number and keyset pagination of GET /api/files at increasing depth.
+
+Seeds one user with ``--rows`` files (a million by default) and times both
+query paths from page 1 down to page 10,000. Keyset latency should stay flat
+while OFFSET/COUNT(*) grows with depth.
+
+    python benchmarks/bench_pagination.py
+    DATABASE_URL=postgresql://localhost/nimbus_bench python benchmarks/bench_pagination.py
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'nimbus_bench_pagination.db')}")
+os.environ.setdefault('CACHE_TYPE', 'null')
+
+from app import create_app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import File  # noqa: E402
+from routes.file_routes import encode_cursor, query_files_after, query_files_page  # noqa: E402
+
+USER_ID = 'bench|pagination'
+PAGES = (1, 10, 100, 1000, 10000)
+
+def seed(rows: int, batch_size: int = 10000) -> None:
+    existing = db.session.query(db.func.count(File.id)).filter(File.user_id == USER_ID).scalar()
+    if existing == rows:
+        return
+    File.query.filter_by(user_id=USER_ID).delete()
+    db.session.commit()
+
+    start = datetime(2020, 1, 1)
+    for offset in range(0, rows, batch_size):
+        db.session.execute(db.insert(File), [{
+            'user_id': USER_ID,
+            'filename': f'file_{i}.txt',
+            's3_url': f'https://bench.s3.amazonaws.com/file_{i}.txt',
+            # A few duplicate timestamps so the id tie-breaker is exercised
+            'upload_date': start + timedelta(seconds=i // 2),
+            'file_size': 1024,
+        } for i in range(offset, min(offset + batch_size, rows))])
+        db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+def cursor_before_page(page: int, per_page: int):
+    """Cursor a client would hold after walking to ``page`` (setup, not timed)"""
+    if page == 1:
+        return None
+    row = db.session.query(File.upload_date, File.id)\
+        .filter(File.user_id == USER_ID)\
+        .order_by(File.upload_date.desc(), File.id.desc())\
+        .offset((page - 1) * per_page - 1)\
+        .first()
+    return (row.upload_date, row.id), encode_cursor(row.upload_date, row.id)
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        print(f"Seeding {args.rows} rows into {db.engine.url.render_as_string(hide_password=True)}")
+        seed(args.rows)
+
+        print(f"{'page':>6} {'offset ms':>10} {'keyset ms':>10}")
+        for page in PAGES:
+            if (page - 1) * args.per_page >= args.rows:
+                break
+            after = cursor_before_page(page, args.per_page)
+            offset_ms = timed(lambda: query_files_page(USER_ID, page, args.per_page), args.repeat)
+            keyset_ms = timed(
+                lambda: query_files_after(USER_ID, after[0] if after else None, args.per_page),
+                args.repeat
+            )
+            db.session.rollback()
+            print(f"{page:>6} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+if __name__ == '__main__':
+    main()
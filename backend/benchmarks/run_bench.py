@@ -0,0 +1,285 @@
+"""Offline load benchmark for the backend API.
+
+Runs the real app behind a threaded HTTP server with SQLite, a local S3
+stand-in (moto) and a locally signed JWKS, so no network or AWS account is
+needed. Measures throughput and p50/p99 latency for auth-only requests,
+shallow and deep listings, and small and large uploads, and writes the
+results to JSON so runs can be compared across versions.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/run_bench.py --label baseline
+    python benchmarks/run_bench.py --label candidate --compare benchmarks/results/baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+BENCH_DOMAIN = 'bench.local'
+BENCH_AUDIENCE = 'https://bench.local/api'
+BENCH_BUCKET = 'nimbus-bench'
+LIST_USER = 'bench|lister'
+UPLOAD_USER = 'bench|uploader'
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+class Environment:
+    """Signing key, JWKS file, S3 stand-in, database and app server for one run"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='nimbus-bench-')
+        self.private_key = None
+
+    def start(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from jose import jwk
+        from moto.server import ThreadedMotoServer
+
+        # Locally signed JWKS, served to the validator from a file:// URL
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_key = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode()
+        public_jwk = jwk.construct(self.private_key, 'RS256').public_key().to_dict()
+        public_jwk.update(kid='bench', alg='RS256', use='sig')
+        jwks_path = os.path.join(self.workdir, 'jwks.json')
+        with open(jwks_path, 'w') as jwks_file:
+            json.dump({'keys': [public_jwk]}, jwks_file)
+
+        s3_port = free_port()
+        self.s3_server = ThreadedMotoServer(ip_address='127.0.0.1', port=s3_port, verbose=False)
+        self.s3_server.start()
+        # Per-request access logs of both servers would drown the results
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+        os.environ.update({
+            'AUTH0_DOMAIN': BENCH_DOMAIN,
+            'AUTH0_API_IDENTIFIER': BENCH_AUDIENCE,
+            'AUTH0_JWKS_URL': f'file://{jwks_path}',
+            'DATABASE_URL': f"sqlite:///{os.path.join(self.workdir, 'bench.db')}",
+            'AWS_ACCESS_KEY_ID': 'bench',
+            'AWS_SECRET_ACCESS_KEY': 'bench',
+            'S3_BUCKET_NAME': BENCH_BUCKET,
+            'S3_BUCKET_REGION': 'us-east-1',
+            'S3_ENDPOINT_URL': f'http://127.0.0.1:{s3_port}',
+            'CACHE_TYPE': 'simple' if self.args.cache else 'null',
+            'USER_QUOTA_BYTES': '0',
+            'UPLOAD_SPOOL_DIR': os.path.join(self.workdir, 'spool'),
+            'SLOW_REQUEST_SECONDS': '3600',
+        })
+
+        # Imported only now, the app reads its configuration at import time
+        from app import create_app
+        from extensions import db, s3
+        from werkzeug.serving import make_server
+
+        self.app = create_app()
+        with self.app.app_context():
+            s3.client.create_bucket(Bucket=BENCH_BUCKET)
+            self.deep_page, self.deep_cursor = self.seed(db)
+
+        port = free_port()
+        self.server = make_server('127.0.0.1', port, self.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{port}'
+
+    def seed(self, db, batch_size=10000):
+        """Gives LIST_USER ``--rows`` files and returns a deep page and its cursor"""
+        from models import File
+        from routes.file_routes import encode_cursor
+
+        rows = self.args.rows
+        start = datetime(2020, 1, 1)
+        for offset in range(0, rows, batch_size):
+            db.session.execute(db.insert(File), [{
+                'user_id': LIST_USER,
+                'filename': f'file_{i}.txt',
+                's3_url': f'https://{BENCH_BUCKET}.s3.amazonaws.com/file_{i}.txt',
+                'upload_date': start + timedelta(seconds=i),
+                'file_size': 1024,
+            } for i in range(offset, min(offset + batch_size, rows))])
+            db.session.commit()
+
+        per_page = 20
+        deep_page = max(rows // per_page - 1, 1)
+        row = db.session.query(File.upload_date, File.id)\
+            .filter(File.user_id == LIST_USER)\
+            .order_by(File.upload_date.desc(), File.id.desc())\
+            .offset((deep_page - 1) * per_page - 1 if deep_page > 1 else 0)\
+            .first()
+        return deep_page, encode_cursor(row.upload_date, row.id)
+
+    def token(self, user_id):
+        from jose import jwt
+        return jwt.encode({
+            'sub': user_id,
+            'aud': BENCH_AUDIENCE,
+            'iss': f'https://{BENCH_DOMAIN}/',
+            'exp': int(time.time()) + 3600,
+        }, self.private_key, algorithm='RS256', headers={'kid': 'bench'})
+
+    def stop(self):
+        self.server.shutdown()
+        self.s3_server.stop()
+
+def upload_body(size: int, large: bool):
+    """Unique content every call so deduplication never short-circuits the upload"""
+    marker = uuid.uuid4().hex.encode()
+    if large:
+        return 'bench.pdf', b'%PDF-1.4\n' + marker + os.urandom(max(size - len(marker) - 9, 0))
+    return 'bench.txt', marker + b'x' * max(size - len(marker), 0)
+
+def build_scenarios(env, args):
+    list_headers = {'Authorization': f'Bearer {env.token(LIST_USER)}'}
+    upload_headers = {'Authorization': f'Bearer {env.token(UPLOAD_USER)}'}
+
+    def get(path, headers):
+        return lambda session: session.get(env.base_url + path, headers=headers)
+
+    def upload(size, large):
+        def send(session):
+            name, body = upload_body(size, large)
+            return session.post(env.base_url + '/api/upload', headers=upload_headers, files={'file': (name, body)})
+        return send
+
+    large_requests = max(args.requests // 20, 5)
+    return {
+        'auth': (get('/api/me', list_headers), args.requests),
+        'list_shallow': (get('/api/files?page=1', list_headers), args.requests),
+        'list_deep_page': (get(f'/api/files?page={env.deep_page}', list_headers), args.requests),
+        'list_deep_cursor': (get(f'/api/files?cursor={env.deep_cursor}', list_headers), args.requests),
+        'upload_small': (upload(args.small_size, False), args.requests),
+        'upload_large': (upload(args.large_size, True), large_requests),
+    }
+
+def run_scenario(send, total, concurrency):
+    import requests
+
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        response = send(local.session)
+        return time.perf_counter() - started, response.status_code
+
+    # Warm up connections, key and token caches outside the measurement
+    for _ in range(min(concurrency, total)):
+        one(None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in outcomes]
+    return {
+        'requests': total,
+        'errors': sum(1 for _, status in outcomes if status >= 400),
+        'throughput_rps': round(total / elapsed, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    header = f"{'scenario':<18} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    if baseline:
+        header += f" {'rps Δ':>8} {'p50 Δ':>8} {'p99 Δ':>8}"
+    print(header)
+    for name, result in results.items():
+        line = (f"{name:<18} {result['throughput_rps']:>9.1f} {result['p50_ms']:>9.2f} "
+                f"{result['p99_ms']:>9.2f} {result['errors']:>7}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            def delta(key):
+                return f"{(result[key] - previous[key]) / previous[key] * 100:+.1f}%" if previous[key] else 'n/a'
+            line += f" {delta('throughput_rps'):>8} {delta('p50_ms'):>8} {delta('p99_ms'):>8}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', default=None, help='Name of the result file, defaults to the git revision.')
+    parser.add_argument('--output-dir', default=os.path.join(BACKEND_DIR, 'benchmarks', 'results'))
+    parser.add_argument('--compare', default=None, help='Earlier result file to compare against.')
+    parser.add_argument('--scenarios', nargs='*', default=None, help='Subset of scenarios to run.')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=100000, help='Files seeded for the listing user.')
+    parser.add_argument('--small-size', type=int, default=4 * 1024)
+    parser.add_argument('--large-size', type=int, default=32 * 1024 * 1024)
+    parser.add_argument('--cache', action='store_true', help='Enable the in-process list cache.')
+    args = parser.parse_args()
+
+    env = Environment(args)
+    env.start()
+    try:
+        scenarios = build_scenarios(env, args)
+        results = {}
+        for name, (send, total) in scenarios.items():
+            if args.scenarios and name not in args.scenarios:
+                continue
+            print(f"Running {name} ({total} requests)...", file=sys.stderr)
+            results[name] = run_scenario(send, total, args.concurrency)
+    finally:
+        env.stop()
+
+    revision = git_revision()
+    report = {
+        'label': args.label or revision or 'unlabelled',
+        'revision': revision,
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output_dir', 'compare', 'label')},
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    print_results(results, baseline)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"{report['label']}.json")
+    with open(output_path, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {output_path}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """In-process cache bounded by entry count, with a per-entry TTL"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _store(self, key, value, timeout):
+        self._data[key] = (value, time.monotonic() + timeout if timeout else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key: str, value: bytes, timeout: Optional[int] = None) -> None:
+        with self._lock:
+            self._store(key, value, timeout)
+
+    def add(self, key: str, value: bytes, timeout: Optional[int] = None) -> bool:
+        """Sets ``key`` only if it is not present, returns whether it was set"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or time.monotonic() < entry[1]):
+                return False
+            self._store(key, value, timeout)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+class LocalRedis:
+    """In-memory stand-in for the subset of redis-py that RedisCache uses.
+
+    Selected with ``CACHE_REDIS_URL=memory://``. Every app created in the
+    process shares one instance, so tests can run several apps as if they
+    were workers behind one Redis without a server.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and time.monotonic() >= entry[1]:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (value if isinstance(value, bytes) else str(value).encode(),
+                               time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match=None):
+        prefix = match[:-1] if match and match.endswith('*') else match
+        with self._lock:
+            keys = list(self._data)
+        return iter([key for key in keys if prefix is None or key.startswith(prefix)])
+
+local_redis = LocalRedis()
+
+class RedisCache:
+    """Cache shared between processes and hosts, backed by Redis.
+
+    Any client with the redis-py interface works. ``memory://`` selects the
+    in-process LocalRedis stand-in for tests and local runs.
+    """
+
+    def __init__(self, client, prefix='nimbus:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        if url == 'memory://':
+            return cls(local_redis, **kwargs)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_TYPE 'redis' requires the redis package (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, timeout: Optional[int] = None) -> None:
+        self.client.set(self.prefix + key, value, ex=timeout or None)
+
+    def add(self, key: str, value: bytes, timeout: Optional[int] = None) -> bool:
+        return bool(self.client.set(self.prefix + key, value, ex=timeout or None, nx=True))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+class NullCache:
+    """Caches nothing, every lookup is a miss"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def add(self, key, value, timeout=None):
+        return True
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+class Cache:
+    """Cache front used by the routes.
+
+    Values are pre-serialized bytes so a hit can be returned as-is. Entries
+    that belong to a user are keyed by that user's generation token, and
+    invalidating the user just replaces the token, which orphans every page
+    and ``per_page`` variant cached for them in O(1); orphans age out through
+    TTL and LRU eviction. Backend errors are logged and treated as misses so
+    a cache outage never fails a request.
+
+    The 'simple' backend lives in one process, so a write only moves the
+    generation in the worker that handled it and other workers keep serving
+    their copies until they expire. It is only correct with a single worker
+    process; setting ``CACHE_REDIS_URL`` makes 'redis' the default instead.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.default_timeout = 300
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'errors': 0, 'invalidations': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_REDIS_URL', os.environ.get('CACHE_REDIS_URL'))
+        app.config.setdefault('CACHE_TYPE', os.environ.get('CACHE_TYPE') or
+                              ('redis' if app.config['CACHE_REDIS_URL'] else 'simple'))
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300)))
+        app.config.setdefault('CACHE_MAX_ENTRIES', int(os.environ.get('CACHE_MAX_ENTRIES', 10000)))
+
+        cache_type = app.config['CACHE_TYPE']
+        if cache_type == 'simple':
+            if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+                logger.warning("CACHE_TYPE 'simple' is per process, other workers will serve stale "
+                               "file lists after writes; set CACHE_REDIS_URL to share the cache")
+            self.backend = LRUCache(app.config['CACHE_MAX_ENTRIES'])
+        elif cache_type == 'redis':
+            self.backend = RedisCache.from_url(app.config['CACHE_REDIS_URL'])
+        elif cache_type == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError(f"Unknown CACHE_TYPE: {cache_type}")
+
+        self.default_timeout = app.config['CACHE_DEFAULT_TIMEOUT']
+        app.extensions['cache'] = self
+
+    def _incr(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Cache get failed: {str(e)}")
+            self._incr('errors')
+            value = None
+        self._incr('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key: str, value: bytes, timeout: Optional[int] = None) -> None:
+        try:
+            self.backend.set(key, value, timeout if timeout is not None else self.default_timeout)
+        except Exception as e:
+            logger.warning(f"Cache set failed: {str(e)}")
+            self._incr('errors')
+
+    def delete(self, key: str) -> None:
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.warning(f"Cache delete failed: {str(e)}")
+            self._incr('errors')
+
+    def user_generation(self, user_id: str) -> Optional[str]:
+        """Current generation token of a user, ``None`` if the backend is unreachable"""
+        key = f'gen:{user_id}'
+        try:
+            generation = self.backend.get(key)
+            if generation is None:
+                self.backend.add(key, uuid.uuid4().hex.encode())
+                generation = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Cache generation lookup failed: {str(e)}")
+            self._incr('errors')
+            return None
+        return generation.decode() if isinstance(generation, bytes) else generation
+
+    def user_key(self, user_id: str, *parts) -> Optional[str]:
+        """Cache key scoped to the user's current generation"""
+        generation = self.user_generation(user_id)
+        if generation is None:
+            return None
+        return ':'.join(['user', user_id, generation, *map(str, parts)])
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drops every cached entry of a user by moving them to a new generation"""
+        self._incr('invalidations')
+        # Generation tokens never expire, eviction just starts the user on a fresh one
+        self.set(f'gen:{user_id}', uuid.uuid4().hex.encode(), timeout=0)
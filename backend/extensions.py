@@ -1,2 +1,99 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
\ No newline at end of file
+
+from cache import Cache
+
+db = SQLAlchemy()
+cache = Cache()
+
+class S3:
+    """One thread-safe boto3 S3 client shared by every request in the process.
+
+    The client (and its connection pool) is built on first use, so importing
+    the app or running CLI commands never touches AWS.
+    """
+
+    def __init__(self, app=None):
+        self._client = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.config = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('S3_BUCKET_NAME', os.environ.get('S3_BUCKET_NAME'))
+        app.config.setdefault('S3_BUCKET_REGION', os.environ.get('S3_BUCKET_REGION'))
+        app.config.setdefault('S3_ENDPOINT_URL', os.environ.get('S3_ENDPOINT_URL'))
+        app.config.setdefault('S3_MAX_POOL_CONNECTIONS', int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32)))
+        app.config.setdefault('S3_MAX_ATTEMPTS', int(os.environ.get('S3_MAX_ATTEMPTS', 3)))
+        app.config.setdefault('S3_CONNECT_TIMEOUT', float(os.environ.get('S3_CONNECT_TIMEOUT', 5)))
+        app.config.setdefault('S3_READ_TIMEOUT', float(os.environ.get('S3_READ_TIMEOUT', 60)))
+        app.config.setdefault('S3_PART_SIZE', int(os.environ.get('S3_PART_SIZE', 8 * 1024 * 1024)))
+        app.config.setdefault('S3_UPLOAD_WORKERS', int(os.environ.get('S3_UPLOAD_WORKERS', 16)))
+        app.config.setdefault('S3_MAX_INFLIGHT_PARTS', int(os.environ.get('S3_MAX_INFLIGHT_PARTS', 4)))
+
+        self.config = {key: value for key, value in app.config.items() if key.startswith('S3_')}
+        with self._lock:
+            self._client = None
+        app.extensions['s3'] = self
+
+    @property
+    def bucket(self) -> str:
+        return self.config['S3_BUCKET_NAME']
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Bounded pool that sends multipart parts for every upload in the process"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.config['S3_UPLOAD_WORKERS'],
+                        thread_name_prefix='s3-upload',
+                    )
+        return self._executor
+
+    def _create_client(self):
+        config = Config(
+            region_name=self.config['S3_BUCKET_REGION'],
+            max_pool_connections=self.config['S3_MAX_POOL_CONNECTIONS'],
+            connect_timeout=self.config['S3_CONNECT_TIMEOUT'],
+            read_timeout=self.config['S3_READ_TIMEOUT'],
+            retries={'max_attempts': self.config['S3_MAX_ATTEMPTS'], 'mode': 'standard'},
+            tcp_keepalive=True,
+            # SigV4 signs the checksum headers of presigned PUTs, so S3 enforces them
+            signature_version='s3v4',
+        )
+        # Credentials come from the standard chain (env vars, profile, instance role)
+        return boto3.session.Session().client(
+            's3',
+            endpoint_url=self.config['S3_ENDPOINT_URL'],
+            config=config,
+        )
+
+    def object_url(self, key: str) -> str:
+        endpoint = self.config['S3_ENDPOINT_URL']
+        if endpoint:
+            return f"{endpoint.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.config['S3_BUCKET_REGION']}.amazonaws.com/{key}"
+
+    def key_for_url(self, url: str):
+        """Inverse of object_url, ``None`` for URLs outside this bucket"""
+        prefix = self.object_url('')
+        return url[len(prefix):] if url.startswith(prefix) else None
+
+s3 = S3()
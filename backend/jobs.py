@@ -0,0 +1,329 @@
+import fcntl
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from boto3.s3.transfer import TransferConfig
+
+from extensions import cache, db, s3
+from metrics import stage
+from models import File, UploadJob
+from storage import add_reference, content_key, store_object
+from usage import QuotaExceeded, charge_usage, has_room
+
+logger = logging.getLogger(__name__)
+
+# Write progress to the database at most this often per job
+PROGRESS_INTERVAL = 1.0
+
+def try_lock(spooled) -> bool:
+    """Takes the exclusive lock that marks a spool file as in use by a live process"""
+    try:
+        fcntl.flock(spooled.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+# Job states a worker may still pick up
+UNFINISHED = ('queued', 'running')
+
+def set_unfinished_status(job_id: str, status: str, **values) -> bool:
+    """Moves a job to ``status`` unless it has finished meanwhile, returns whether it did.
+
+    Another process may finish the job between our read and this write, so
+    the update is conditional instead of overwriting what it recorded.
+    """
+    return db.session.execute(
+        db.update(UploadJob)
+        .where(UploadJob.id == job_id, UploadJob.status.in_(UNFINISHED))
+        .values(status=status, **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount > 0
+
+def mark_lost(job_id: str) -> bool:
+    """Fails an unfinished job whose spool file is gone"""
+    return set_unfinished_status(job_id, 'failed', error='Upload was lost in a server restart, please upload again')
+
+class SpoolWriter:
+    """Writer for stream_to_s3 that spools the upload to a local file"""
+
+    def __init__(self, path):
+        self.key = path
+        self.size = 0
+        self._file = open(path, 'wb')
+        # Held while the body arrives so recovery never takes the file for an orphan
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+        self.size += len(data)
+
+    def complete(self) -> None:
+        self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self.key):
+            os.remove(self.key)
+
+class UploadQueue:
+    """Bounded local queue of spooled uploads and the worker threads draining it.
+
+    Uploads are spooled to ``UPLOAD_SPOOL_DIR`` by the request, which returns
+    straight away; workers push them to S3 and write the File row. Job state
+    lives in the upload_jobs table so any process on the box can report it.
+    No broker is needed, and a full queue is reported to the caller so the
+    route can shed load instead of filling the disk.
+
+    The queue itself is in memory, so ``recover`` picks up accepted jobs left
+    behind by a restart or crash. A process holds an exclusive lock on a spool
+    file while it writes or uploads it, which lets every worker process run
+    recovery at start without taking over jobs a live sibling is handling.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.config = {}
+        self._queue = None
+        self._workers = []
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('UPLOAD_SPOOL_DIR', os.environ.get(
+            'UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'nimbus-spool')))
+        app.config.setdefault('UPLOAD_WORKERS', int(os.environ.get('UPLOAD_WORKERS', 4)))
+        app.config.setdefault('UPLOAD_QUEUE_SIZE', int(os.environ.get('UPLOAD_QUEUE_SIZE', 64)))
+        app.config.setdefault('UPLOAD_MAX_ATTEMPTS', int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 3)))
+        app.config.setdefault('UPLOAD_RETRY_BACKOFF', float(os.environ.get('UPLOAD_RETRY_BACKOFF', 2)))
+        # Spool files without a job row are only removed once they are this old
+        app.config.setdefault('UPLOAD_ORPHAN_GRACE', float(os.environ.get('UPLOAD_ORPHAN_GRACE', 300)))
+
+        self.app = app
+        self.config = {key: value for key, value in app.config.items() if key.startswith('UPLOAD_')}
+        self._queue = queue.Queue(maxsize=self.config['UPLOAD_QUEUE_SIZE'])
+        os.makedirs(self.config['UPLOAD_SPOOL_DIR'], exist_ok=True)
+        app.extensions['upload_queue'] = self
+
+    def spool_path(self, job_id: str) -> str:
+        return os.path.join(self.config['UPLOAD_SPOOL_DIR'], f'{job_id}.upload')
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, job_id: str) -> bool:
+        """Queues a job, returns False when the queue is full"""
+        self._start_workers()
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            return False
+        return True
+
+    def recover(self) -> None:
+        """Resumes jobs a previous process accepted but never finished.
+
+        Unfinished jobs whose spool file survived are queued again, the rest
+        are marked failed, and spool files of finished or unknown jobs are
+        removed. Must run in an app context once the tables exist.
+        """
+        spool_dir = self.config['UPLOAD_SPOOL_DIR']
+        resumable = []
+        for (job_id,) in db.session.query(UploadJob.id).filter(UploadJob.status.in_(UNFINISHED)).all():
+            try:
+                with open(self.spool_path(job_id), 'rb') as spooled:
+                    if not try_lock(spooled):
+                        continue  # A live process is spooling or uploading it
+            except FileNotFoundError:
+                mark_lost(job_id)
+                continue
+            if set_unfinished_status(job_id, 'queued'):
+                resumable.append(job_id)
+
+        pending = {job_id for (job_id,) in db.session.query(UploadJob.id)
+                   .filter(UploadJob.status.in_(UNFINISHED))}
+        db.session.commit()
+
+        stale_before = time.time() - self.config['UPLOAD_ORPHAN_GRACE']
+        for name in os.listdir(spool_dir):
+            job_id, extension = os.path.splitext(name)
+            path = os.path.join(spool_dir, name)
+            if extension != '.upload' or job_id in pending:
+                continue
+            try:
+                with open(path, 'rb') as spooled:
+                    # Requests spool before they insert the job row
+                    if try_lock(spooled) and os.path.getmtime(path) < stale_before:
+                        os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        if resumable:
+            logger.info(f"Resuming {len(resumable)} upload jobs from a previous run")
+            self._start_workers()
+            # Blocking puts, so a backlog larger than the queue is never dropped
+            threading.Thread(
+                target=lambda: [self._queue.put(job_id) for job_id in resumable],
+                name='upload-recovery',
+                daemon=True,
+            ).start()
+
+    def _start_workers(self):
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(self.config['UPLOAD_WORKERS']):
+                worker = threading.Thread(target=self._run, name=f'upload-worker-{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self.process(job_id)
+            except Exception as e:
+                logger.error(f"Upload job {job_id} crashed: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def process(self, job_id: str) -> None:
+        job = db.session.get(UploadJob, job_id)
+        if job is None or job.status not in UNFINISHED:
+            return
+
+        path = self.spool_path(job_id)
+        try:
+            spooled = open(path, 'rb')
+        except FileNotFoundError:
+            mark_lost(job_id)
+            db.session.commit()
+            return
+        # Recovery may queue a job that another process already has
+        if not try_lock(spooled):
+            spooled.close()
+            return
+        db.session.refresh(job)
+        if job.status not in UNFINISHED:
+            spooled.close()
+            return
+
+        max_attempts = self.config['UPLOAD_MAX_ATTEMPTS']
+        try:
+            while True:
+                job.status = 'running'
+                job.attempts += 1
+                db.session.commit()
+                try:
+                    spooled.seek(0)
+                    new_file = self._store(job, spooled)
+                    break
+                except QuotaExceeded as e:
+                    db.session.rollback()
+                    job.status = 'failed'
+                    job.error = e.message
+                    db.session.commit()
+                    return
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"Upload job {job_id} attempt {job.attempts} failed: {str(e)}")
+                    if job.attempts >= max_attempts:
+                        job.status = 'failed'
+                        job.error = 'Failed to upload file to S3'
+                        db.session.commit()
+                        return
+                    job.status = 'queued'
+                    db.session.commit()
+                    time.sleep(self.config['UPLOAD_RETRY_BACKOFF'] * job.attempts)
+
+            job.status = 'succeeded'
+            job.file_id = new_file.id
+            job.bytes_done = job.bytes_total
+            db.session.commit()
+
+            # Invalidate cache
+            cache.invalidate_user(job.user_id)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            spooled.close()
+
+    def _store(self, job: UploadJob, spooled) -> File:
+        # Stored content needs no transfer, the reference is enough
+        stored = add_reference(job.content_hash)
+        if stored is None:
+            # Do not hold the write transaction open for the whole transfer
+            db.session.rollback()
+            if not has_room(job.user_id, job.bytes_total):
+                raise QuotaExceeded()
+            with stage('s3_upload'):
+                s3.client.upload_fileobj(
+                    spooled,
+                    s3.bucket,
+                    content_key(job.content_hash),
+                    ExtraArgs={'ContentType': job.content_type} if job.content_type else None,
+                    Callback=ProgressRecorder(db.engine, job.id),
+                    Config=TransferConfig(max_concurrency=4),
+                )
+            stored = store_object(job.content_hash, job.bytes_total)
+
+        # Counted in the same transaction as the File insert
+        charge_usage(job.user_id, job.bytes_total)
+
+        new_file = File(
+            user_id=job.user_id,
+            filename=job.filename,
+            s3_url=s3.object_url(stored.s3_key),
+            upload_date=datetime.utcnow(),
+            file_size=job.bytes_total,
+            content_hash=job.content_hash
+        )
+        db.session.add(new_file)
+        with stage('db_commit'):
+            db.session.commit()
+        return new_file
+
+class ProgressRecorder:
+    """boto3 transfer callback that writes throttled progress to the job row.
+
+    Transfer threads run outside the app context, so this talks to the engine
+    directly in short transactions of its own.
+    """
+
+    def __init__(self, engine, job_id):
+        self.engine = engine
+        self.job_id = job_id
+        self.bytes_done = 0
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_transferred):
+        with self._lock:
+            self.bytes_done += bytes_transferred
+            now = time.monotonic()
+            if now - self._last_write < PROGRESS_INTERVAL:
+                return
+            self._last_write = now
+            bytes_done = self.bytes_done
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    db.update(UploadJob)
+                    .where(UploadJob.id == self.job_id)
+                    .values(bytes_done=bytes_done)
+                )
+        except Exception as e:
+            logger.warning(f"Failed to record progress of job {self.job_id}: {str(e)}")
+
+upload_queue = UploadQueue()
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits up to multi-GB uploads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+        for labels, (counts, count, total) in sorted(series.items()):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+request_duration = Histogram(
+    'nimbus_request_duration_seconds',
+    'Time spent handling a request.',
+    ('method', 'endpoint', 'status'),
+)
+stage_duration = Histogram(
+    'nimbus_stage_duration_seconds',
+    'Time spent in each stage of a request or background job.',
+    ('endpoint', 'stage'),
+)
+
+@contextmanager
+def stage(name: str):
+    """Times a block as one stage of the current request.
+
+    Outside a request (background workers) the time is still recorded,
+    under the 'background' endpoint.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if has_request_context() and hasattr(g, 'stage_timings'):
+            g.stage_timings[name] = g.stage_timings.get(name, 0.0) + elapsed
+        else:
+            stage_duration.observe(('background', name), elapsed)
+
+class Metrics:
+    """Request and stage timing hooks, exposed in Prometheus format at /metrics.
+
+    Requests slower than ``SLOW_REQUEST_SECONDS`` are logged with their
+    per-stage breakdown. Counter and gauge sources (cache events, queue
+    depth) can be added with ``register_collector``.
+    """
+
+    def __init__(self, app=None):
+        self.slow_request_seconds = 1.0
+        self._collectors = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_REQUEST_SECONDS', float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0)))
+        self.slow_request_seconds = app.config['SLOW_REQUEST_SECONDS']
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        app.extensions['metrics'] = self
+
+    def register_collector(self, name, help_text, collect, kind='gauge'):
+        """Exposes ``collect()``, a dict of label value to number, as a gauge or counter.
+
+        Counters must only ever go up; they get the ``_total`` suffix so
+        ``rate()`` can be used on them.
+        """
+        if kind == 'counter' and not name.endswith('_total'):
+            name += '_total'
+        self._collectors[name] = (help_text, collect, kind)
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.stage_timings = {}
+
+    def _after_request(self, response):
+        started = getattr(g, 'request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint == 'metrics':
+            return response
+
+        request_duration.observe((request.method, endpoint, str(response.status_code)), elapsed)
+        for name, seconds in g.stage_timings.items():
+            stage_duration.observe((endpoint, name), seconds)
+
+        if elapsed >= self.slow_request_seconds:
+            breakdown = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in g.stage_timings.items())
+            other = elapsed - sum(g.stage_timings.values())
+            logger.warning(
+                f"Slow request {request.method} {request.path} -> {response.status_code} "
+                f"took {elapsed * 1000:.1f}ms ({breakdown or 'no stages'}, other={other * 1000:.1f}ms)"
+            )
+        return response
+
+    def render(self):
+        lines = request_duration.render() + stage_duration.render()
+        for name, (help_text, collect, kind) in self._collectors.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for label, value in sorted(collect().items()):
+                lines.append(f'{name}{{name="{label}"}} {value}')
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+metrics = Metrics()
@@ -1,5 +1,6 @@
 from extensions import db
 from datetime import datetime
+from sqlalchemy import BigInteger, Integer, inspect
 
 class File(db.Model):
     __tablename__ = 'files'
@@ -9,9 +10,99 @@ class File(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     s3_url = db.Column(db.String(1024), nullable=False)
     upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    file_size = db.Column(db.Integer, nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    # SHA-256 of the content, NULL for objects that are not content-addressed
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
 
     # Add indexes
     __table_args__ = (
         db.Index('idx_user_upload_date', user_id, upload_date),
-    )
\ No newline at end of file
+    )
+
+class StoredObject(db.Model):
+    """A content-addressed S3 object and the number of File rows using it"""
+    __tablename__ = 'stored_objects'
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    s3_key = db.Column(db.String(1024), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class PendingUpload(db.Model):
+    """A presigned upload handed to a user, which only that user may complete"""
+    __tablename__ = 'pending_uploads'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), nullable=False)
+    s3_key = db.Column(db.String(1024), nullable=False)
+    # Expected SHA-256 for content-addressed keys, NULL for per-user multipart keys
+    content_hash = db.Column(db.String(64), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_pending_user_key', user_id, s3_key),
+    )
+
+class UploadJob(db.Model):
+    """An upload spooled to local disk and waiting for, or being pushed by, a worker"""
+    __tablename__ = 'upload_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.String(50), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(255), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    bytes_total = db.Column(db.BigInteger, nullable=False)
+    bytes_done = db.Column(db.BigInteger, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255), nullable=True)
+    file_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserUsage(db.Model):
+    """Running totals of a user's files, maintained alongside every insert and delete"""
+    __tablename__ = 'user_usage'
+
+    user_id = db.Column(db.String(50), primary_key=True)
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def widen_file_size_column():
+    """Turns an INTEGER files.file_size into BIGINT.
+
+    Uploads can exceed 2 GiB, but ``create_all`` never alters an existing
+    table, so databases created before the column was widened would still
+    overflow once such an upload has reached S3. SQLite integers are already
+    64-bit and are left alone.
+    """
+    engine = db.engine
+    if engine.dialect.name not in ('postgresql', 'mysql', 'mariadb'):
+        return
+    columns = {column['name']: column for column in inspect(engine).get_columns(File.__tablename__)}
+    column = columns.get('file_size')
+    if column is None or not isinstance(column['type'], Integer) or isinstance(column['type'], BigInteger):
+        return
+    if engine.dialect.name == 'postgresql':
+        statement = 'ALTER TABLE files ALTER COLUMN file_size TYPE BIGINT'
+    else:
+        statement = 'ALTER TABLE files MODIFY file_size BIGINT NOT NULL'
+    with engine.begin() as connection:
+        connection.execute(db.text(statement))
+
+def add_content_hash_column():
+    """Adds files.content_hash and its index to databases created before it existed.
+
+    ``create_all`` only creates missing tables, so without this every insert
+    into an older ``files`` table fails once the upload has reached S3.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    if 'content_hash' in {column['name'] for column in inspector.get_columns(File.__tablename__)}:
+        return
+    with engine.begin() as connection:
+        connection.execute(db.text('ALTER TABLE files ADD COLUMN content_hash VARCHAR(64)'))
+        connection.execute(db.text('CREATE INDEX ix_files_content_hash ON files (content_hash)'))
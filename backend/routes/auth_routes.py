@@ -0,0 +1,18 @@
+# Standard library
+from typing import Tuple
+
+# Third-party imports
+from flask import Blueprint, request, jsonify
+
+# Local application imports
+from validator import requires_auth
+
+# Create a Blueprint for the auth routes
+auth_bp = Blueprint('auth', __name__)
+
+@auth_bp.route('/me', methods=['GET'])
+@requires_auth
+def get_current_user() -> Tuple[dict, int]:
+    """Returns who the token belongs to. Does nothing beyond authentication,
+    so it doubles as a cheap token check for clients and load tests."""
+    return jsonify({'user_id': request.auth_payload['sub']}), 200
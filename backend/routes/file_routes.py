@@ -1,17 +1,52 @@
 # Standard library
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import hashlib
+import logging
+import math
+import json
 import os
+import uuid
+from typing import Optional, Tuple
 
 # Third-party imports
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import NoCredentialsError, ClientError
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import and_, func, or_
 from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 # Local application imports
-from extensions import db
-from models import File
+from extensions import cache, db, s3
+from jobs import SpoolWriter, upload_queue
+from metrics import stage
+from models import File, PendingUpload, StoredObject, UploadJob
+from storage import (
+    HASH_CHUNK_SIZE,
+    add_reference,
+    content_key,
+    hash_fileobj,
+    is_sha256,
+    object_exists,
+    release_reference,
+    staging_key,
+    store_object,
+)
+from uploads import (
+    SNIFF_SIZE,
+    DiscardWriter,
+    FilePart,
+    FileTooLarge,
+    MultipartReader,
+    S3MultipartWriter,
+    UploadError,
+    content_matches_extension,
+    stream_to_s3,
+)
+from usage import USER_QUOTA_BYTES, QuotaExceeded, charge_usage, credit_usage, current_usage, has_room
 from validator import requires_auth
 
 # Configure logging
@@ -22,7 +57,18 @@ file_bp = Blueprint('files', __name__)
 
 # Constants
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
-MAX_FILE_SIZE = 10 * 1024 * 1024  
+MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE', 5 * 1024 * 1024 * 1024))
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+PRESIGN_EXPIRES = int(os.environ.get('PRESIGN_EXPIRES', 3600))
+# S3 limit on the number of parts in one multipart upload
+MAX_UPLOAD_PARTS = 10000
+MAX_PER_PAGE = 100
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 100))
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1024 * 1024 * 1024))
+# Batch files already run concurrently on the shared pool, so each transfer stays single-threaded
+BATCH_TRANSFER_CONFIG = TransferConfig(use_threads=False)
+FILE_LIST_COLUMNS = (File.id, File.filename, File.s3_url, File.upload_date, File.file_size)
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -33,18 +79,10 @@ def validate_aws_credentials() -> None:
     if missing_vars:
         raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-def upload_to_s3(file: FileStorage, bucket_name: str, region: str) -> [str]:
+def upload_to_s3(file: FileStorage, key: str, config: Optional[TransferConfig] = None) -> Optional[str]:
     try:
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-            region_name=region
-        )
-
-        filename = secure_filename(file.filename)
-        s3.upload_fileobj(file, bucket_name, filename)
-        return f"https://{bucket_name}.s3.{region}.amazonaws.com/{filename}"
+        s3.client.upload_fileobj(file, s3.bucket, key, Config=config)
+        return s3.object_url(key)
 
     except ClientError as e:
         logger.error(f"S3 upload failed: {str(e)}")
@@ -53,55 +91,404 @@ def upload_to_s3(file: FileStorage, bucket_name: str, region: str) -> [str]:
         logger.error(f"Unexpected error during S3 upload: {str(e)}")
         return None
 
+def open_upload_part(user_id: str) -> FilePart:
+    """Finds the 'file' field of a streamed multipart body and validates its name.
+
+    Nothing is buffered, the returned part is read from the request stream.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        raise UploadError('No file part in the request')
+
+    # Reject declared oversized bodies before reading anything
+    if request.content_length and request.content_length > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        raise FileTooLarge()
+
+    if request.content_length and not has_room(user_id, max(request.content_length - MULTIPART_OVERHEAD, 0)):
+        raise QuotaExceeded()
+
+    reader = MultipartReader(request.stream, boundary)
+    file = next((part for part in reader.files() if part.name == 'file'), None)
+    if file is None:
+        raise UploadError('No file part in the request')
+
+    if file.filename == '':
+        raise UploadError('No selected file')
+
+    if not allowed_file(file.filename) or not allowed_file(secure_filename(file.filename)):
+        raise UploadError('File type not allowed')
+
+    return file
+
 @file_bp.route('/upload', methods=['POST'])
 @requires_auth
 def upload_file() -> Tuple[dict, int]:
     user_id = request.auth_payload['sub']
 
-    # File validation
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part in the request'}), 400
-    
-    file = request.files['file']
+    try:
+        with stage('parse'):
+            file = open_upload_part(user_id)
+
+        # A client that already knows the hash of stored content skips the S3 transfer,
+        # the body is still read to verify the hash
+        claimed_hash = request.headers.get('X-Content-SHA256', '').lower()
+        if is_sha256(claimed_hash) and object_exists(claimed_hash):
+            writer = DiscardWriter()
+        else:
+            # Stream straight into S3, the size limit and type are checked on the way
+            writer = S3MultipartWriter(
+                s3.client,
+                s3.bucket,
+                staging_key(),
+                s3.executor,
+                s3.config['S3_PART_SIZE'],
+                s3.config['S3_MAX_INFLIGHT_PARTS'],
+                content_type=file.content_type,
+            )
+        with stage('s3_upload'):
+            size, content_hash = stream_to_s3(file, writer, file.filename.rsplit('.', 1)[1], MAX_FILE_SIZE)
+
+        # Counted in the same transaction as the File insert
+        try:
+            with stage('quota'):
+                charge_usage(user_id, size)
+        except QuotaExceeded:
+            db.session.rollback()
+            if writer.key is not None:
+                delete_staged_object(writer.key)
+            raise
+
+        with stage('store'):
+            if writer.key is None:
+                if content_hash != claimed_hash:
+                    db.session.rollback()
+                    return jsonify({'error': 'Content hash mismatch'}), 400
+                stored = add_reference(content_hash)
+                if stored is None:
+                    db.session.rollback()
+                    return jsonify({'error': 'Stored content was removed during upload, please retry'}), 409
+            else:
+                stored = store_object(content_hash, size, source_key=writer.key)
+        s3_url = s3.object_url(stored.s3_key)
+
+        new_file = File(
+            user_id=user_id,
+            filename=secure_filename(file.filename),
+            s3_url=s3_url,
+            upload_date=datetime.utcnow(),
+            file_size=size,
+            content_hash=content_hash
+        )
+        db.session.add(new_file)
+        with stage('db_commit'):
+            db.session.commit()
+
+        if writer.key is not None:
+            with stage('cleanup'):
+                delete_staged_object(writer.key)
+
+        # Invalidate cache
+        cache.invalidate_user(user_id)
+
+        return file_created_response(new_file)
+
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+    except ClientError as e:
+        logger.error(f"S3 upload failed: {str(e)}")
+        return jsonify({'error': 'Failed to upload file to S3'}), 500
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database error occurred'}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'An unexpected error occurred'}), 500
+
+@file_bp.route('/upload/async', methods=['POST'])
+@requires_auth
+def upload_file_async() -> Tuple[dict, int]:
+    """Spools the upload to local disk and leaves the S3 transfer to a worker"""
+    user_id = request.auth_payload['sub']
+
+    # Shed load before reading the body when the workers are already behind
+    if upload_queue.full():
+        return jsonify({'error': 'Upload queue is full, please retry later'}), 503, {'Retry-After': '5'}
+
+    job_id = uuid.uuid4().hex
+    path = upload_queue.spool_path(job_id)
+    try:
+        with stage('parse'):
+            file = open_upload_part(user_id)
+        with stage('spool'):
+            size, content_hash = stream_to_s3(file, SpoolWriter(path), file.filename.rsplit('.', 1)[1], MAX_FILE_SIZE)
+        # The worker charges the usage, this only turns away uploads that cannot fit
+        if not has_room(user_id, size):
+            os.remove(path)
+            raise QuotaExceeded()
+
+        job = UploadJob(
+            id=job_id,
+            user_id=user_id,
+            filename=secure_filename(file.filename),
+            content_type=file.content_type,
+            content_hash=content_hash,
+            status='queued',
+            bytes_total=size,
+            bytes_done=0,
+            attempts=0
+        )
+        db.session.add(job)
+        with stage('db_commit'):
+            db.session.commit()
+
+        if not upload_queue.submit(job_id):
+            db.session.delete(job)
+            db.session.commit()
+            os.remove(path)
+            return jsonify({'error': 'Upload queue is full, please retry later'}), 503, {'Retry-After': '5'}
+
+        return jsonify({
+            'message': 'Upload accepted',
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}'
+        }), 202
+
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database error occurred'}), 500
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+        logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'An unexpected error occurred'}), 500
+
+def delete_staged_object(key: str) -> None:
+    try:
+        s3.client.delete_object(Bucket=s3.bucket, Key=key)
+    except ClientError as e:
+        logger.warning(f"Failed to delete staged object {key}: {str(e)}")
+
+def validate_file(file: FileStorage) -> Tuple[Optional[str], int]:
+    """Checks name, type, size and leading bytes, returns (error, size)"""
     if not file or file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return 'No selected file', 0
 
-    if not allowed_file(file.filename):
-        return jsonify({'error': 'File type not allowed'}), 400
+    if not allowed_file(file.filename) or not allowed_file(secure_filename(file.filename)):
+        return 'File type not allowed', 0
 
-    # Check file size
     file.seek(0, os.SEEK_END)
     size = file.tell()
     file.seek(0)
     if size > MAX_FILE_SIZE:
-        return jsonify({'error': 'File size exceeds maximum limit'}), 400
+        return 'File size exceeds maximum limit', size
+
+    head = file.read(SNIFF_SIZE)
+    file.seek(0)
+    if not content_matches_extension(head, file.filename.rsplit('.', 1)[1]):
+        return 'File content does not match its type', size
+
+    return None, size
+
+@file_bp.route('/upload/batch', methods=['POST'])
+@requires_auth
+def upload_batch() -> Tuple[dict, int]:
+    user_id = request.auth_payload['sub']
 
+    request.max_content_length = MAX_BATCH_SIZE
     try:
-        s3_url = upload_to_s3(
-            file,
-            os.environ['S3_BUCKET_NAME'],
-            os.environ['S3_BUCKET_REGION']
-        )
-        
-        if not s3_url:
-            return jsonify({'error': 'Failed to upload file to S3'}), 500
+        with stage('parse'):
+            files = request.files.getlist('files')
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Batch size exceeds maximum limit'}), 413
+
+    if not files:
+        return jsonify({'error': 'No file part in the request'}), 400
+
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'At most {MAX_BATCH_FILES} files per batch'}), 400
+
+    results = [{'filename': file.filename} for file in files]
+    hashing = []
+    batch_size = 0
+    for index, file in enumerate(files):
+        error, size = validate_file(file)
+        if not error and not has_room(user_id, batch_size + size):
+            error = 'Storage quota exceeded'
+        if error:
+            results[index]['error'] = error
+            continue
+        batch_size += size
+        results[index]['size'] = size
+        hashing.append((index, s3.executor.submit(hash_fileobj, file)))
+
+    # Hash everything first so content that is already stored is never transferred
+    with stage('hash'):
+        hashes = {index: future.result() for index, future in hashing}
+        stored_hashes = {
+            row.content_hash for row in db.session.query(StoredObject.content_hash)
+            .filter(StoredObject.content_hash.in_(set(hashes.values())))
+        } if hashes else set()
+
+    # Transfers run concurrently on the shared pool, the rows go in with a single commit
+    uploading = {
+        index: s3.executor.submit(upload_to_s3, files[index], content_key(content_hash), BATCH_TRANSFER_CONFIG)
+        for index, content_hash in hashes.items() if content_hash not in stored_hashes
+    }
+
+    new_files = []
+    try:
+        # Wait for every transfer up front so the S3 time is measured on its own
+        with stage('s3_upload'):
+            for future in uploading.values():
+                future.exception()
+
+        for index, content_hash in hashes.items():
+            try:
+                charge_usage(user_id, results[index]['size'])
+            except QuotaExceeded as e:
+                results[index]['error'] = e.message
+                # Never leave a transfer reading from a request that is about to end
+                if index in uploading:
+                    uploading[index].result()
+                continue
+
+            if index in uploading:
+                if not uploading[index].result():
+                    credit_usage(user_id, results[index]['size'])
+                    results[index]['error'] = 'Failed to upload file to S3'
+                    continue
+                stored = store_object(content_hash, results[index]['size'])
+            else:
+                stored = add_reference(content_hash)
+                if stored is None:
+                    credit_usage(user_id, results[index]['size'])
+                    results[index]['error'] = 'Stored content was removed during upload, please retry'
+                    continue
+
+            new_file = File(
+                user_id=user_id,
+                filename=secure_filename(files[index].filename),
+                s3_url=s3.object_url(stored.s3_key),
+                upload_date=datetime.utcnow(),
+                file_size=results[index].pop('size'),
+                content_hash=content_hash
+            )
+            new_files.append((index, new_file))
+
+        if new_files:
+            db.session.add_all([new_file for _, new_file in new_files])
+            with stage('db_commit'):
+                db.session.commit()
+
+            # Invalidate cache
+            cache.invalidate_user(user_id)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database error occurred'}), 500
+
+    for index, new_file in new_files:
+        results[index].update({'url': new_file.s3_url, 'file_id': new_file.id})
+    for result in results:
+        result.pop('size', None)
+
+    uploaded = len(new_files)
+    if uploaded == len(files):
+        status = 201
+    elif uploaded:
+        status = 207
+    else:
+        status = 400
+
+    return jsonify({
+        'results': results,
+        'uploaded': uploaded,
+        'failed': len(files) - uploaded
+    }), status
+
+def user_upload_prefix(user_id: str) -> str:
+    """Key prefix that presigned uploads of this user live under until they are completed"""
+    return f"uploads/{hashlib.sha256(user_id.encode()).hexdigest()[:32]}/"
+
+def record_pending_upload(user_id: str, key: str, content_hash: Optional[str] = None) -> None:
+    """Remembers a presigned upload so only this user can complete it, within its expiry"""
+    now = datetime.utcnow()
+    PendingUpload.query.filter(PendingUpload.user_id == user_id, PendingUpload.expires_at < now)\
+        .delete(synchronize_session=False)
+    db.session.add(PendingUpload(
+        user_id=user_id,
+        s3_key=key,
+        content_hash=content_hash,
+        expires_at=now + timedelta(seconds=PRESIGN_EXPIRES)
+    ))
+    db.session.commit()
+
+def file_created_response(new_file: File) -> Tuple[dict, int]:
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'url': new_file.s3_url,
+        'file_id': new_file.id
+    }), 201
+
+@file_bp.route('/upload/check', methods=['POST'])
+@requires_auth
+def check_upload() -> Tuple[dict, int]:
+    """Creates the file from already stored content so the client can skip the upload.
+
+    Only content the caller already has a file for qualifies. Knowing a hash
+    is no proof of having the bytes, and answering for other users' content
+    would reveal which files are stored. Anything else has to be uploaded,
+    and is still deduplicated in S3 once its bytes are verified.
+    """
+    user_id = request.auth_payload['sub']
+    data = request.get_json(silent=True) or {}
+
+    content_hash = (data.get('sha256') or '').lower()
+    filename = secure_filename(data.get('filename') or '')
+
+    if not is_sha256(content_hash):
+        return jsonify({'error': 'A SHA-256 hex digest is required'}), 400
+
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+
+    try:
+        owned = db.session.query(File.id).filter_by(user_id=user_id, content_hash=content_hash).first()
+        stored = add_reference(content_hash) if owned else None
+        if stored is None:
+            db.session.rollback()
+            return jsonify({'exists': False}), 200
+
+        try:
+            charge_usage(user_id, stored.file_size)
+        except QuotaExceeded as e:
+            db.session.rollback()
+            return jsonify({'error': e.message}), e.status_code
 
         new_file = File(
             user_id=user_id,
-            filename=secure_filename(file.filename),
-            s3_url=s3_url,
+            filename=filename,
+            s3_url=s3.object_url(stored.s3_key),
             upload_date=datetime.utcnow(),
-            file_size=size
+            file_size=stored.file_size,
+            content_hash=content_hash
         )
         db.session.add(new_file)
         db.session.commit()
 
         # Invalidate cache
-        cache.delete(f'user_files_{user_id}')
+        cache.invalidate_user(user_id)
 
         return jsonify({
+            'exists': True,
             'message': 'File uploaded successfully',
-            'url': s3_url,
+            'url': new_file.s3_url,
             'file_id': new_file.id
         }), 201
 
@@ -109,49 +496,391 @@ def upload_file() -> Tuple[dict, int]:
         db.session.rollback()
         logger.error(f"Database error: {str(e)}")
         return jsonify({'error': 'Database error occurred'}), 500
+
+@file_bp.route('/upload/presign', methods=['POST'])
+@requires_auth
+def presign_upload() -> Tuple[dict, int]:
+    user_id = request.auth_payload['sub']
+    data = request.get_json(silent=True) or {}
+
+    filename = data.get('filename') or ''
+    size = data.get('size')
+    content_type = data.get('content_type')
+    content_hash = (data.get('sha256') or '').lower()
+
+    if filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    filename = secure_filename(filename)
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return jsonify({'error': 'File size is required'}), 400
+
+    if size > MAX_FILE_SIZE:
+        return jsonify({'error': 'File size exceeds maximum limit'}), 413
+
+    if not has_room(user_id, size):
+        return jsonify({'error': 'Storage quota exceeded'}), 413
+
+    try:
+        part_size = s3.config['S3_PART_SIZE']
+        if size <= part_size:
+            # Single PUTs land on a key of their own and are moved to the content-addressed
+            # key by /upload/complete. The checksum is part of the signature, so S3 rejects
+            # a body that does not match the hash, and completion checks it again.
+            if not is_sha256(content_hash):
+                return jsonify({'error': 'A SHA-256 hex digest is required'}), 400
+            checksum = base64.b64encode(bytes.fromhex(content_hash)).decode()
+            params = {
+                'Bucket': s3.bucket,
+                'Key': f"{user_upload_prefix(user_id)}{uuid.uuid4().hex}/{filename}",
+                'ChecksumAlgorithm': 'SHA256',
+                'ChecksumSHA256': checksum,
+            }
+            if content_type:
+                params['ContentType'] = content_type
+            url = s3.client.generate_presigned_url('put_object', Params=params, ExpiresIn=PRESIGN_EXPIRES)
+            record_pending_upload(user_id, params['Key'], content_hash)
+            return jsonify({
+                'key': params['Key'],
+                'url': url,
+                'headers': {'x-amz-sdk-checksum-algorithm': 'SHA256', 'x-amz-checksum-sha256': checksum}
+            }), 200
+
+        # S3 cannot check a whole-object SHA-256 for multipart uploads, so these stay
+        # under a per-user key and are not deduplicated
+        key = f"{user_upload_prefix(user_id)}{uuid.uuid4().hex}/{filename}"
+        params = {'Bucket': s3.bucket, 'Key': key}
+        if content_type:
+            params['ContentType'] = content_type
+
+        # Grow the parts for very large files so we stay under the S3 part limit
+        part_size = max(part_size, math.ceil(size / MAX_UPLOAD_PARTS))
+        upload_id = s3.client.create_multipart_upload(**params)['UploadId']
+        parts = [{
+            'part_number': part_number,
+            'url': s3.client.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': s3.bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+                ExpiresIn=PRESIGN_EXPIRES
+            )
+        } for part_number in range(1, math.ceil(size / part_size) + 1)]
+        record_pending_upload(user_id, key)
+
+        return jsonify({
+            'key': key,
+            'upload_id': upload_id,
+            'part_size': part_size,
+            'parts': parts
+        }), 200
+
+    except ClientError as e:
+        logger.error(f"Failed to presign upload: {str(e)}")
+        return jsonify({'error': 'Failed to prepare upload'}), 500
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database error occurred'}), 500
+
+@file_bp.route('/upload/complete', methods=['POST'])
+@requires_auth
+def complete_upload() -> Tuple[dict, int]:
+    """Registers an object uploaded through a URL from /upload/presign.
+
+    Only keys presigned for the caller are accepted, and the expected hash
+    comes from that presign rather than the request. Every such rejection
+    gets the same response, so the endpoint reveals nothing about what
+    content is stored.
+    """
+    user_id = request.auth_payload['sub']
+    data = request.get_json(silent=True) or {}
+
+    key = data.get('key') or ''
+    upload_id = data.get('upload_id')
+    parts = data.get('parts') or []
+
+    invalid_upload = jsonify({'error': 'Upload not found'}), 400
+    if not key.startswith(user_upload_prefix(user_id)) or '..' in key:
+        return invalid_upload
+    filename = key.rsplit('/', 1)[1]
+
+    try:
+        # Completing a multipart upload twice must not create a second row
+        existing = File.query.filter_by(user_id=user_id, s3_url=s3.object_url(key)).first()
+        if existing:
+            return file_created_response(existing)
+
+        pending = PendingUpload.query.filter(
+            PendingUpload.user_id == user_id,
+            PendingUpload.s3_key == key,
+            PendingUpload.expires_at >= datetime.utcnow()
+        ).first()
+        if pending is None:
+            return invalid_upload
+        content_hash = pending.content_hash
+
+        if upload_id:
+            try:
+                s3.client.complete_multipart_upload(
+                    Bucket=s3.bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={'Parts': [
+                        {'PartNumber': int(part['part_number']), 'ETag': part['etag']}
+                        for part in sorted(parts, key=lambda part: int(part['part_number']))
+                    ]}
+                )
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'error': 'Invalid part list'}), 400
+            except ClientError as e:
+                logger.error(f"Failed to complete multipart upload: {str(e)}")
+                return jsonify({'error': 'Failed to complete upload'}), 400
+
+        # Verify what actually landed in the bucket rather than trusting the client
+        with stage('s3_verify'):
+            try:
+                size = s3.client.head_object(Bucket=s3.bucket, Key=key)['ContentLength']
+            except ClientError:
+                return invalid_upload
+
+            head = b''
+            actual_hash = None
+            if content_hash and size <= s3.config['S3_PART_SIZE']:
+                # The bytes become the shared content for this hash, so hash them here rather
+                # than rely on S3 having enforced the signed checksum. Single PUTs are at
+                # most one part, so this reads little.
+                digest = hashlib.sha256()
+                for chunk in s3.client.get_object(Bucket=s3.bucket, Key=key)['Body'].iter_chunks(HASH_CHUNK_SIZE):
+                    if len(head) < SNIFF_SIZE:
+                        head += chunk[:SNIFF_SIZE - len(head)]
+                    digest.update(chunk)
+                actual_hash = digest.hexdigest()
+            elif size:
+                head = s3.client.get_object(Bucket=s3.bucket, Key=key, Range=f'bytes=0-{SNIFF_SIZE - 1}')['Body'].read()
+
+        error = None
+        if content_hash and actual_hash != content_hash:
+            error = invalid_upload
+        elif size > MAX_FILE_SIZE:
+            error = jsonify({'error': 'File size exceeds maximum limit'}), 413
+        elif not content_matches_extension(head, filename.rsplit('.', 1)[1]):
+            error = jsonify({'error': 'File content does not match its type'}), 400
+        else:
+            try:
+                charge_usage(user_id, size)
+            except QuotaExceeded as e:
+                db.session.rollback()
+                error = jsonify({'error': e.message}), e.status_code
+        if error:
+            db.session.delete(pending)
+            db.session.commit()
+            delete_staged_object(key)
+            return error
+
+        s3_key = key
+        if content_hash:
+            s3_key = store_object(content_hash, size, source_key=key).s3_key
+
+        new_file = File(
+            user_id=user_id,
+            filename=filename,
+            s3_url=s3.object_url(s3_key),
+            upload_date=datetime.utcnow(),
+            file_size=size,
+            content_hash=content_hash
+        )
+        db.session.add(new_file)
+        db.session.delete(pending)
+        db.session.commit()
+
+        if content_hash:
+            delete_staged_object(key)
+
+        # Invalidate cache
+        cache.invalidate_user(user_id)
+
+        return file_created_response(new_file)
+
+    except ClientError as e:
+        logger.error(f"S3 error while completing upload: {str(e)}")
+        return jsonify({'error': 'Failed to complete upload'}), 500
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database error occurred'}), 500
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
+@file_bp.route('/files/<int:file_id>', methods=['DELETE'])
+@requires_auth
+def delete_file(file_id: int) -> Tuple[dict, int]:
+    user_id = request.auth_payload['sub']
+
+    try:
+        file = File.query.filter_by(id=file_id, user_id=user_id).first()
+        if file is None:
+            return jsonify({'error': 'File not found'}), 404
+
+        db.session.delete(file)
+        credit_usage(user_id, file.file_size)
+        if file.content_hash:
+            # The object is only removed with its last reference
+            key = release_reference(file.content_hash)
+        else:
+            key = s3.key_for_url(file.s3_url)
+            # Legacy objects were stored by bare filename and may be shared between users
+            if key and not key.startswith(user_upload_prefix(user_id)):
+                key = None
+
+        # Delete before committing, the reference row lock keeps new uploads of
+        # this content waiting until the object is gone
+        if key:
+            s3.client.delete_object(Bucket=s3.bucket, Key=key)
+        db.session.commit()
+
+        # Invalidate cache
+        cache.invalidate_user(user_id)
+
+        return jsonify({'message': 'File deleted successfully'}), 200
+
+    except ClientError as e:
+        db.session.rollback()
+        logger.error(f"S3 delete failed: {str(e)}")
+        return jsonify({'error': 'Failed to delete file from S3'}), 500
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database error occurred'}), 500
+
+@file_bp.route('/usage', methods=['GET'])
+@requires_auth
+def get_user_usage() -> Tuple[dict, int]:
+    user_id = request.auth_payload['sub']
+
+    bytes_used, file_count = current_usage(user_id)
+    return jsonify({
+        'bytes_used': bytes_used,
+        'file_count': file_count,
+        'quota_bytes': USER_QUOTA_BYTES or None,
+        'bytes_remaining': max(USER_QUOTA_BYTES - bytes_used, 0) if USER_QUOTA_BYTES else None
+    }), 200
+
+def encode_cursor(upload_date: datetime, file_id: int) -> str:
+    raw = json.dumps([upload_date.isoformat(), file_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_date, file_id = json.loads(raw)
+        return datetime.fromisoformat(upload_date), int(file_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def serialize_file_rows(rows) -> list:
+    return [{
+        'id': row.id,
+        'filename': row.filename,
+        'url': row.s3_url,
+        'upload_date': row.upload_date.isoformat(),
+        'file_size': row.file_size
+    } for row in rows]
+
+def files_query(user_id: str):
+    """Only the columns the listing needs, no ORM objects"""
+    return db.session.query(*FILE_LIST_COLUMNS).filter(File.user_id == user_id)
+
+def count_files(user_id: str) -> int:
+    return db.session.query(func.count(File.id)).filter(File.user_id == user_id).scalar()
+
+def query_files_page(user_id: str, page: int, per_page: int) -> dict:
+    """Page-number pagination, costs an OFFSET scan and a COUNT(*)"""
+    rows = files_query(user_id)\
+        .order_by(File.upload_date.desc(), File.id.desc())\
+        .offset((page - 1) * per_page)\
+        .limit(per_page)\
+        .all()
+    total = count_files(user_id)
+
+    return {
+        'files': serialize_file_rows(rows),
+        'total': total,
+        'pages': math.ceil(total / per_page),
+        'current_page': page
+    }
+
+def query_files_after(user_id: str, after: Optional[Tuple[datetime, int]], per_page: int,
+                      with_total: bool = False) -> dict:
+    """Keyset pagination over idx_user_upload_date, flat cost at any depth"""
+    query = files_query(user_id)
+    if after:
+        upload_date, file_id = after
+        # The plain range bound lets the index seek straight to the cursor
+        query = query.filter(
+            File.upload_date <= upload_date,
+            or_(
+                File.upload_date < upload_date,
+                and_(File.upload_date == upload_date, File.id < file_id)
+            )
+        )
+
+    rows = query.order_by(File.upload_date.desc(), File.id.desc()).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    result = {
+        'files': serialize_file_rows(rows),
+        'next_cursor': encode_cursor(rows[-1].upload_date, rows[-1].id) if has_more else None,
+        'has_more': has_more,
+        'per_page': per_page
+    }
+    if with_total:
+        result['total'] = count_files(user_id)
+    return result
+
 @file_bp.route('/files', methods=['GET'])
 @requires_auth
 def list_files() -> Tuple[dict, int]:
 
     user_id = request.auth_payload['sub']
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_PER_PAGE)
+    # Passing cursor (empty for the first page) switches to keyset pagination
+    cursor = request.args.get('cursor')
+    with_total = request.args.get('with_total', '0') in ('1', 'true')
+
+    # Check cache first, hits are served without re-serializing
+    with stage('cache'):
+        if cursor is None:
+            cache_key = cache.user_key(user_id, 'files', f'p{page}', f'n{per_page}')
+        else:
+            cache_key = cache.user_key(user_id, 'files', f'c{cursor}', f'n{per_page}', f't{int(with_total)}')
+        cached_result = cache.get(cache_key) if cache_key else None
+    if cached_result is not None:
+        return current_app.response_class(cached_result, mimetype='application/json'), 200
 
-    # Check cache first
-    cache_key = f'user_files_{user_id}_p{page}'
-    cached_result = cache.get(cache_key)
-    if cached_result:
-        return jsonify(cached_result), 200
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        files = File.query.filter_by(user_id=user_id)\
-            .order_by(File.upload_date.desc())\
-            .paginate(page=page, per_page=per_page, error_out=False)
-
-        file_list = [{
-            'id': file.id,
-            'filename': file.filename,
-            'url': file.s3_url,
-            'upload_date': file.upload_date.isoformat(),
-            'file_size': file.file_size
-        } for file in files.items]
-
-        result = {
-            'files': file_list,
-            'total': files.total,
-            'pages': files.pages,
-            'current_page': files.page
-        }
+        with stage('db_query'):
+            if cursor is None:
+                result = query_files_page(user_id, page, per_page)
+            else:
+                result = query_files_after(user_id, after, per_page, with_total)
 
         # Cache the result
-        cache.set(cache_key, result, timeout=300)  # Cache for 5 minutes
+        body = json.dumps(result).encode()
+        if cache_key:
+            cache.set(cache_key, body)  # Cache for CACHE_DEFAULT_TIMEOUT (5 minutes)
 
-        return jsonify(result), 200
+        return current_app.response_class(body, mimetype='application/json'), 200
 
     except Exception as e:
         logger.error(f"Error fetching files: {str(e)}")
-        return jsonify({'error': 'Failed to retrieve files'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to retrieve files'}), 500
@@ -0,0 +1,40 @@
+# Standard library
+import logging
+from typing import Tuple
+
+# Third-party imports
+from flask import Blueprint, request, jsonify
+
+# Local application imports
+from extensions import db
+from models import UploadJob
+from validator import requires_auth
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create a Blueprint for the job routes
+job_bp = Blueprint('jobs', __name__)
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+@requires_auth
+def get_job(job_id: str) -> Tuple[dict, int]:
+    user_id = request.auth_payload['sub']
+
+    job = db.session.get(UploadJob, job_id)
+    if job is None or job.user_id != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'filename': job.filename,
+        'bytes_total': job.bytes_total,
+        'bytes_done': job.bytes_done,
+        'progress': round(job.bytes_done * 100 / job.bytes_total) if job.bytes_total else 100,
+        'attempts': job.attempts,
+        'error': job.error,
+        'file_id': job.file_id,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat()
+    }), 200
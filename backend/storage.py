@@ -0,0 +1,100 @@
+import hashlib
+import re
+import uuid
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, s3
+from models import StoredObject
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def is_sha256(value) -> bool:
+    return isinstance(value, str) and SHA256_RE.match(value) is not None
+
+def content_key(content_hash: str) -> str:
+    """S3 key of the object holding the content with this hash"""
+    return f"objects/{content_hash[:2]}/{content_hash}"
+
+def staging_key() -> str:
+    """Temporary key for uploads whose hash is only known once they finish.
+
+    Staging objects are deleted once the upload is stored; a bucket lifecycle
+    rule on ``staging/`` should clean up after crashed workers.
+    """
+    return f"staging/{uuid.uuid4().hex}"
+
+def hash_fileobj(fileobj) -> str:
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def object_exists(content_hash: str) -> bool:
+    """Unlocked existence check, only a hint until add_reference succeeds"""
+    return db.session.query(StoredObject.content_hash).filter_by(content_hash=content_hash).first() is not None
+
+def add_reference(content_hash: str) -> Optional[StoredObject]:
+    """Takes a reference on an already stored object, ``None`` if there is none.
+
+    The increment is a single UPDATE so concurrent uploads of the same content
+    cannot lose a count, and it blocks on a delete that is removing the object.
+    """
+    updated = db.session.execute(
+        db.update(StoredObject)
+        .where(StoredObject.content_hash == content_hash)
+        .values(ref_count=StoredObject.ref_count + 1)
+    ).rowcount
+    if not updated:
+        return None
+    return db.session.get(StoredObject, content_hash, populate_existing=True)
+
+def store_object(content_hash: str, size: int, source_key: Optional[str] = None) -> StoredObject:
+    """Takes a reference on the content, storing it first if it is new.
+
+    ``source_key`` is where the bytes were staged; it is copied to the
+    content-addressed key only when no stored object exists yet. Without it
+    the caller has already written the content-addressed key.
+    """
+    stored = add_reference(content_hash)
+    if stored is not None:
+        return stored
+
+    key = content_key(content_hash)
+    if source_key and source_key != key:
+        s3.client.copy({'Bucket': s3.bucket, 'Key': source_key}, s3.bucket, key)
+
+    try:
+        with db.session.begin_nested():
+            stored = StoredObject(content_hash=content_hash, s3_key=key, file_size=size, ref_count=1)
+            db.session.add(stored)
+        return stored
+    except IntegrityError:
+        # A concurrent upload of the same content inserted it first
+        stored = add_reference(content_hash)
+        if stored is None:
+            raise
+        return stored
+
+def release_reference(content_hash: str) -> Optional[str]:
+    """Drops a reference, returning the S3 key to delete if it was the last one.
+
+    The row is removed in the caller's transaction, and the lock it holds keeps
+    concurrent add_reference calls waiting until the caller commits. Callers
+    should delete the returned key before committing.
+    """
+    db.session.execute(
+        db.update(StoredObject)
+        .where(StoredObject.content_hash == content_hash)
+        .values(ref_count=StoredObject.ref_count - 1)
+    )
+    stored = db.session.get(StoredObject, content_hash, populate_existing=True)
+    if stored is None or stored.ref_count > 0:
+        return None
+    db.session.delete(stored)
+    db.session.flush()
+    return stored.s3_key
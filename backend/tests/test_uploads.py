@@ -0,0 +1,149 @@
+import hashlib
+import io
+
+import pytest
+import requests
+from botocore.exceptions import ClientError
+
+from conftest import TEST_BUCKET, auth_headers, unique_text
+
+def upload(client, user_id, body, filename='file.txt'):
+    return client.post(
+        '/api/upload',
+        headers=auth_headers(user_id),
+        data={'file': (io.BytesIO(body), filename)},
+        content_type='multipart/form-data',
+    )
+
+def presign(client, user_id, body, filename='file.txt'):
+    response = client.post('/api/upload/presign', headers=auth_headers(user_id), json={
+        'filename': filename,
+        'size': len(body),
+        'sha256': hashlib.sha256(body).hexdigest(),
+    })
+    assert response.status_code == 200
+    return response.json
+
+def complete(client, user_id, key, body=None):
+    payload = {'key': key}
+    if body is not None:
+        payload['sha256'] = hashlib.sha256(body).hexdigest()
+    return client.post('/api/upload/complete', headers=auth_headers(user_id), json=payload)
+
+def presigned_upload(client, user_id, body, put_body=None):
+    presigned = presign(client, user_id, body)
+    requests.put(presigned['url'], data=body if put_body is None else put_body, headers=presigned['headers'])
+    return presigned, complete(client, user_id, presigned['key'], body)
+
+def object_exists_in_s3(key):
+    from extensions import s3
+    try:
+        s3.client.head_object(Bucket=TEST_BUCKET, Key=key)
+    except ClientError:
+        return False
+    return True
+
+def stored_object(app, content_hash):
+    from extensions import db
+    from models import StoredObject
+    with app.app_context():
+        return db.session.get(StoredObject, content_hash)
+
+def file_count(app, user_id):
+    from models import File
+    with app.app_context():
+        return File.query.filter_by(user_id=user_id).count()
+
+def test_presigned_upload_is_stored_under_its_content_key(app, client):
+    from storage import content_key
+
+    body = unique_text()
+    presigned, response = presigned_upload(client, 'victim', body)
+
+    assert response.status_code == 201
+    assert response.json['url'].endswith(content_key(hashlib.sha256(body).hexdigest()))
+    # The per-upload staging key is gone once the content is stored
+    assert not object_exists_in_s3(presigned['key'])
+
+@pytest.mark.parametrize('claim', ['content_key', 'own_presign_without_put', 'victim_key'])
+def test_hash_only_complete_is_rejected(app, client, claim):
+    from storage import content_key
+
+    body = unique_text()
+    victim_upload, response = presigned_upload(client, 'victim', body)
+    assert response.status_code == 201
+
+    if claim == 'content_key':
+        key = content_key(hashlib.sha256(body).hexdigest())
+    elif claim == 'own_presign_without_put':
+        key = presign(client, 'attacker', body)['key']
+    else:
+        key = victim_upload['key']
+
+    response = complete(client, 'attacker', key, body)
+
+    assert response.status_code == 400
+    assert response.json == {'error': 'Upload not found'}
+    assert file_count(app, 'attacker') == 0
+    assert stored_object(app, hashlib.sha256(body).hexdigest()).ref_count == 1
+
+def test_complete_rejects_bytes_that_do_not_match_the_presigned_hash(app, client):
+    body = unique_text()
+    presigned, response = presigned_upload(client, 'user', body, put_body=unique_text())
+
+    # Same answer as for a key that was never presigned
+    assert response.status_code == 400
+    assert response.json == {'error': 'Upload not found'}
+    assert not object_exists_in_s3(presigned['key'])
+    assert stored_object(app, hashlib.sha256(body).hexdigest()) is None
+
+def test_check_refuses_content_the_caller_does_not_own(app, client):
+    body = unique_text()
+    assert upload(client, 'owner', body).status_code == 201
+    content_hash = hashlib.sha256(body).hexdigest()
+
+    response = client.post('/api/upload/check', headers=auth_headers('attacker'),
+                           json={'sha256': content_hash, 'filename': 'copy.txt'})
+
+    assert response.status_code == 200
+    assert response.json == {'exists': False}
+    assert file_count(app, 'attacker') == 0
+
+    response = client.post('/api/upload/check', headers=auth_headers('owner'),
+                           json={'sha256': content_hash, 'filename': 'copy.txt'})
+
+    assert response.status_code == 201
+    assert response.json['exists'] is True
+    assert stored_object(app, content_hash).ref_count == 2
+
+def test_reference_counts_across_upload_and_delete(app, client):
+    body = unique_text()
+    content_hash = hashlib.sha256(body).hexdigest()
+
+    first = upload(client, 'alice', body)
+    second = upload(client, 'bob', body)
+    _, third = presigned_upload(client, 'carol', body)
+    assert {first.status_code, second.status_code, third.status_code} == {201}
+    assert first.json['url'] == second.json['url'] == third.json['url']
+
+    stored = stored_object(app, content_hash)
+    assert stored.ref_count == 3
+
+    for user_id, response, remaining in (('alice', first, 2), ('carol', third, 1)):
+        deleted = client.delete(f"/api/files/{response.json['file_id']}", headers=auth_headers(user_id))
+        assert deleted.status_code == 200
+        assert stored_object(app, content_hash).ref_count == remaining
+        assert object_exists_in_s3(stored.s3_key)
+
+    deleted = client.delete(f"/api/files/{second.json['file_id']}", headers=auth_headers('bob'))
+    assert deleted.status_code == 200
+    assert stored_object(app, content_hash) is None
+    assert not object_exists_in_s3(stored.s3_key)
+
+def test_delete_of_another_users_file_is_refused(app, client):
+    response = upload(client, 'owner', unique_text())
+
+    deleted = client.delete(f"/api/files/{response.json['file_id']}", headers=auth_headers('attacker'))
+
+    assert deleted.status_code == 404
+    assert file_count(app, 'owner') == 1
@@ -0,0 +1,116 @@
+import io
+import threading
+from datetime import datetime
+
+import pytest
+
+import usage
+from routes import file_routes
+from conftest import auth_headers, unique_text
+
+QUOTA = 1000
+
+@pytest.fixture
+def quota(monkeypatch):
+    monkeypatch.setattr(usage, 'USER_QUOTA_BYTES', QUOTA)
+    monkeypatch.setattr(file_routes, 'USER_QUOTA_BYTES', QUOTA)
+    return QUOTA
+
+def upload(client, user_id, body, filename='file.txt'):
+    return client.post(
+        '/api/upload',
+        headers=auth_headers(user_id),
+        data={'file': (io.BytesIO(body), filename)},
+        content_type='multipart/form-data',
+    )
+
+def get_usage(client, user_id):
+    response = client.get('/api/usage', headers=auth_headers(user_id))
+    assert response.status_code == 200
+    return response.json
+
+def add_legacy_file(app, user_id, size):
+    """A file from before usage counters were kept, with no counter row"""
+    from extensions import db
+    from models import File
+    with app.app_context():
+        legacy = File(
+            user_id=user_id,
+            filename='legacy.txt',
+            s3_url='https://legacy.example.com/legacy.txt',
+            upload_date=datetime(2024, 1, 1),
+            file_size=size,
+        )
+        db.session.add(legacy)
+        db.session.commit()
+        return legacy.id
+
+def test_upload_over_quota_is_rejected(client, quota):
+    assert upload(client, 'user', unique_text(600)).status_code == 201
+
+    response = upload(client, 'user', unique_text(600))
+
+    assert response.status_code == 413
+    assert get_usage(client, 'user')['bytes_used'] == 600
+
+def test_concurrent_uploads_never_exceed_quota(app, quota):
+    statuses = []
+    lock = threading.Lock()
+
+    def send():
+        response = upload(app.test_client(), 'user', unique_text(300))
+        with lock:
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses.count(201) == 3
+    assert statuses.count(413) == 5
+    result = get_usage(app.test_client(), 'user')
+    assert result['bytes_used'] == 900
+    assert result['file_count'] == 3
+
+def test_preexisting_files_count_towards_quota(app, client, quota):
+    legacy_id = add_legacy_file(app, 'user', 500)
+    assert get_usage(client, 'user')['bytes_used'] == 500
+
+    assert upload(client, 'user', unique_text(600)).status_code == 413
+    assert upload(client, 'user', unique_text(100)).status_code == 201
+    assert get_usage(client, 'user') == {
+        'bytes_used': 600,
+        'file_count': 2,
+        'quota_bytes': QUOTA,
+        'bytes_remaining': 400,
+    }
+
+    deleted = client.delete(f'/api/files/{legacy_id}', headers=auth_headers('user'))
+
+    assert deleted.status_code == 200
+    assert get_usage(client, 'user')['bytes_used'] == 100
+
+def test_credit_never_drops_usage_below_zero(app):
+    from extensions import db
+    with app.app_context():
+        usage.charge_usage('user', 10)
+        db.session.commit()
+        usage.credit_usage('user', 500, count=3)
+        db.session.commit()
+
+        assert usage.current_usage('user') == (0, 0)
+
+def test_reconcile_rebuilds_counters_from_files(app, client):
+    add_legacy_file(app, 'user', 500)
+    assert upload(client, 'user', unique_text(100)).status_code == 201
+
+    from extensions import db
+    from models import UserUsage
+    with app.app_context():
+        db.session.get(UserUsage, 'user').bytes_used = 12345
+        db.session.commit()
+        usage.reconcile_usage()
+
+    assert get_usage(client, 'user')['bytes_used'] == 600
@@ -0,0 +1,258 @@
+import codecs
+import hashlib
+import logging
+import threading
+from typing import Iterator, Tuple
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 2048
+# Upper bound on bytes the decoder may hold between events (headers, small fields)
+MAX_DECODER_BUFFER = 1024 * 1024
+
+# Leading bytes of each allowed binary type
+MAGIC_NUMBERS = {
+    'pdf': (b'%PDF-',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+class FileTooLarge(UploadError):
+    def __init__(self, message='File size exceeds maximum limit'):
+        super().__init__(message, 413)
+
+def content_matches_extension(head: bytes, extension: str) -> bool:
+    """Checks the first bytes of a file against the type its extension claims"""
+    extension = extension.lower()
+    if extension in MAGIC_NUMBERS:
+        return head.startswith(MAGIC_NUMBERS[extension])
+    if extension == 'txt':
+        if b'\x00' in head:
+            return False
+        try:
+            # final=False so a multi-byte character cut off at the end is not an error
+            codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        except UnicodeDecodeError:
+            return False
+        return True
+    return False
+
+class FilePart:
+    """A file field of a multipart body whose data is read lazily from the stream"""
+
+    def __init__(self, name, filename, content_type, events):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self._events = events
+        self._done = False
+
+    def chunks(self) -> Iterator[bytes]:
+        while not self._done:
+            event = next(self._events)
+            if not isinstance(event, Data):
+                raise UploadError('Malformed multipart body')
+            if not event.more_data:
+                self._done = True
+            if event.data:
+                yield event.data
+
+    def drain(self) -> None:
+        for _ in self.chunks():
+            pass
+
+class MultipartReader:
+    """Incremental multipart/form-data parser over a request stream.
+
+    Unlike ``request.files`` nothing is buffered or spooled: file data is
+    handed out chunk by chunk as it arrives, so memory use does not depend
+    on the size of the upload.
+    """
+
+    def __init__(self, stream, boundary: str, chunk_size: int = READ_CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'), MAX_DECODER_BUFFER)
+
+    def _next_events(self):
+        try:
+            while True:
+                event = self._decoder.next_event()
+                if isinstance(event, NeedData):
+                    chunk = self._stream.read(self._chunk_size)
+                    self._decoder.receive_data(chunk or None)
+                elif isinstance(event, Epilogue):
+                    return
+                else:
+                    yield event
+        except RequestEntityTooLarge:
+            raise UploadError('Multipart headers too large', 413)
+        except ValueError:
+            raise UploadError('Malformed multipart body')
+
+    def files(self) -> Iterator[FilePart]:
+        events = self._next_events()
+        for event in events:
+            # Data events of plain form fields fall through and are discarded
+            if isinstance(event, File):
+                part = FilePart(event.name, event.filename, event.headers.get('Content-Type'), events)
+                yield part
+                part.drain()
+
+class S3MultipartWriter:
+    """Streams bytes into S3, sending full parts in parallel on a shared pool.
+
+    At most ``max_inflight`` parts are queued or in flight per upload; ``write``
+    blocks once that limit is reached, which bounds memory to roughly
+    ``(max_inflight + 1) * part_size``. Uploads that never fill a single part
+    are sent with one ``put_object`` call.
+    """
+
+    def __init__(self, client, bucket, key, executor, part_size, max_inflight, content_type=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.executor = executor
+        self.part_size = part_size
+        self.content_type = content_type
+        self.upload_id = None
+        self.size = 0
+
+        self._buffer = bytearray()
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._futures = []
+
+    def _extra_args(self):
+        return {'ContentType': self.content_type} if self.content_type else {}
+
+    def write(self, data: bytes) -> None:
+        self._buffer.extend(data)
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            body = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(body)
+
+    def _submit(self, body: bytes) -> None:
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self._extra_args())
+            self.upload_id = response['UploadId']
+
+        self._slots.acquire()
+        # Fail fast instead of streaming the rest of a body we cannot store
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                self._slots.release()
+                raise future.exception()
+
+        part_number = len(self._futures) + 1
+        future = self.executor.submit(self._upload_part, part_number, body)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number: int, body: bytes) -> dict:
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def complete(self) -> None:
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self._extra_args())
+            self._buffer = bytearray()
+            return
+
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+
+        parts = [future.result() for future in self._futures]
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': parts},
+        )
+
+    def abort(self) -> None:
+        self._buffer = bytearray()
+        if self.upload_id is None:
+            return
+        for future in self._futures:
+            future.cancel()
+        for future in self._futures:
+            if not future.cancelled():
+                future.exception()
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+class DiscardWriter:
+    """Stands in for S3MultipartWriter when the content is already stored"""
+
+    key = None
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+
+    def complete(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        pass
+
+def stream_to_s3(part: FilePart, writer: S3MultipartWriter, extension: str, max_size: int) -> Tuple[int, str]:
+    """Copies a file part into ``writer``, checking its type and size on the way.
+
+    The type is checked against the first ``SNIFF_SIZE`` bytes before anything
+    is sent to S3, and the size limit is enforced as bytes arrive. On any error
+    the S3 upload is aborted and the rest of the part is discarded. Returns
+    the size and SHA-256 hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    head = bytearray()
+    sniffed = False
+    try:
+        for chunk in part.chunks():
+            digest.update(chunk)
+            if writer.size + len(head) + len(chunk) > max_size:
+                raise FileTooLarge()
+            if not sniffed:
+                head.extend(chunk)
+                if len(head) < SNIFF_SIZE:
+                    continue
+                if not content_matches_extension(bytes(head[:SNIFF_SIZE]), extension):
+                    raise UploadError('File content does not match its type')
+                sniffed = True
+                chunk, head = bytes(head), bytearray()
+            writer.write(chunk)
+
+        if not sniffed:
+            if not content_matches_extension(bytes(head), extension):
+                raise UploadError('File content does not match its type')
+            writer.write(bytes(head))
+        writer.complete()
+    except BaseException:
+        try:
+            writer.abort()
+        except Exception as e:
+            logger.error(f"Failed to abort upload of {writer.key}: {str(e)}")
+        raise
+    return writer.size, digest.hexdigest()
@@ -0,0 +1,175 @@
+import logging
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import File, UserUsage
+from uploads import UploadError
+
+logger = logging.getLogger(__name__)
+
+# Per-user storage quota in bytes, 0 disables it
+USER_QUOTA_BYTES = int(os.environ.get('USER_QUOTA_BYTES', 10 * 1024 * 1024 * 1024))
+
+class QuotaExceeded(UploadError):
+    def __init__(self, message='Storage quota exceeded'):
+        super().__init__(message, 413)
+
+def get_usage(user_id: str) -> Optional[UserUsage]:
+    """Single primary key lookup, no scan over files"""
+    return db.session.get(UserUsage, user_id)
+
+def usage_from_files(user_id: str) -> Tuple[int, int]:
+    """Bytes and file count of the user summed over files, for users without a counter row"""
+    # The caller's unflushed File rows must not be counted on top of what it charges
+    with db.session.no_autoflush:
+        bytes_used, file_count = db.session.query(
+            db.func.coalesce(db.func.sum(File.file_size), 0),
+            db.func.count(File.id)
+        ).filter(File.user_id == user_id).one()
+    return int(bytes_used), file_count
+
+def current_usage(user_id: str) -> Tuple[int, int]:
+    """Bytes used and file count, including files from before counters were kept"""
+    usage = get_usage(user_id)
+    if usage is None:
+        return usage_from_files(user_id)
+    return usage.bytes_used, usage.file_count
+
+def has_room(user_id: str, size: int) -> bool:
+    """Cheap pre-check before accepting bytes, charge_usage has the final word"""
+    if not USER_QUOTA_BYTES:
+        return True
+    return current_usage(user_id)[0] + size <= USER_QUOTA_BYTES
+
+def charge_usage(user_id: str, size: int, count: int = 1) -> None:
+    """Adds files to the user's usage in the caller's transaction.
+
+    The quota is checked in the same UPDATE that increments the counters, so
+    concurrent uploads of one user cannot overshoot it. Raises QuotaExceeded
+    without changing anything when the files do not fit. A user's first
+    counter row starts from the files they already have.
+    """
+    for _ in range(2):
+        statement = db.update(UserUsage).where(UserUsage.user_id == user_id)
+        if USER_QUOTA_BYTES:
+            statement = statement.where(UserUsage.bytes_used + size <= USER_QUOTA_BYTES)
+        updated = db.session.execute(statement.values(
+            bytes_used=UserUsage.bytes_used + size,
+            file_count=UserUsage.file_count + count,
+            updated_at=datetime.utcnow()
+        )).rowcount
+        if updated:
+            return
+
+        if get_usage(user_id) is not None:
+            raise QuotaExceeded()
+        existing_bytes, existing_count = usage_from_files(user_id)
+        if USER_QUOTA_BYTES and existing_bytes + size > USER_QUOTA_BYTES:
+            raise QuotaExceeded()
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(UserUsage(
+                    user_id=user_id,
+                    bytes_used=existing_bytes + size,
+                    file_count=existing_count + count
+                ))
+            return
+        except IntegrityError:
+            # A concurrent upload created the row first, go through the UPDATE again
+            continue
+    raise QuotaExceeded()
+
+def credit_usage(user_id: str, size: int, count: int = 1) -> None:
+    """Removes files from the user's usage in the caller's transaction.
+
+    Counters that drifted low (files charged before the counters existed)
+    stop at zero rather than going negative and handing out extra quota.
+    """
+    db.session.execute(
+        db.update(UserUsage)
+        .where(UserUsage.user_id == user_id)
+        .values(
+            bytes_used=db.case((UserUsage.bytes_used > size, UserUsage.bytes_used - size), else_=0),
+            file_count=db.case((UserUsage.file_count > count, UserUsage.file_count - count), else_=0),
+            updated_at=datetime.utcnow()
+        )
+    )
+
+def reconcile_usage(batch_size: int = 500) -> int:
+    """Rebuilds the counters from files, ``batch_size`` users per transaction.
+
+    Each batch locks the usage rows of its users before summing their files,
+    so uploads racing with the rebuild wait for it instead of being lost.
+    Returns the number of users reconciled.
+    """
+    reconciled = 0
+
+    last_user_id = ''
+    while True:
+        user_ids = [row.user_id for row in db.session.query(File.user_id)
+                    .filter(File.user_id > last_user_id)
+                    .group_by(File.user_id)
+                    .order_by(File.user_id)
+                    .limit(batch_size)]
+        if not user_ids:
+            break
+
+        existing = {usage.user_id: usage for usage in db.session.query(UserUsage)
+                    .filter(UserUsage.user_id.in_(user_ids))
+                    .with_for_update()}
+        totals = db.session.query(
+            File.user_id,
+            db.func.sum(File.file_size),
+            db.func.count(File.id)
+        ).filter(File.user_id.in_(user_ids)).group_by(File.user_id)
+
+        for user_id, bytes_used, file_count in totals:
+            usage = existing.get(user_id)
+            if usage is None:
+                usage = UserUsage(user_id=user_id)
+                db.session.add(usage)
+            usage.bytes_used = bytes_used
+            usage.file_count = file_count
+        db.session.commit()
+
+        reconciled += len(user_ids)
+        last_user_id = user_ids[-1]
+
+    # Users whose files are all gone still need their counters zeroed
+    has_files = db.exists().where(File.user_id == UserUsage.user_id)
+    last_user_id = ''
+    while True:
+        stale = db.session.query(UserUsage)\
+            .filter(UserUsage.user_id > last_user_id, ~has_files)\
+            .order_by(UserUsage.user_id)\
+            .limit(batch_size)\
+            .with_for_update()\
+            .all()
+        if not stale:
+            break
+
+        for usage in stale:
+            usage.bytes_used = 0
+            usage.file_count = 0
+        db.session.commit()
+
+        reconciled += len(stale)
+        last_user_id = stale[-1].user_id
+
+    return reconciled
+
+usage_cli = AppGroup('usage', help='Manage per-user storage usage counters.')
+
+@usage_cli.command('reconcile')
+@click.option('--batch-size', default=500, show_default=True, help='Users per transaction.')
+def reconcile_command(batch_size):
+    """Rebuild usage counters from the files table."""
+    count = reconcile_usage(batch_size)
+    click.echo(f"Reconciled usage for {count} users")
@@ -1,20 +1,177 @@
 import os
 import json
+import threading
+import time
+from collections import OrderedDict
 from urllib.request import urlopen
 from functools import wraps
-from jose import jwt
+from jose import jwt, jwk
 from flask import request, jsonify
 
+from metrics import stage
+
 # Load environment variables for Auth0
 AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
 API_IDENTIFIER = os.environ.get("AUTH0_API_IDENTIFIER")
 ALGORITHMS = ["RS256"]
 
+# JWKS location. Defaults to the tenant's well-known endpoint, but can point at a
+# local stand-in server or a file:// URL for offline use.
+JWKS_URL = os.environ.get("AUTH0_JWKS_URL") or f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+JWKS_CACHE_TTL = int(os.environ.get("JWKS_CACHE_TTL", 3600))
+JWKS_MIN_REFRESH_INTERVAL = float(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", 30))
+JWKS_FETCH_TIMEOUT = float(os.environ.get("JWKS_FETCH_TIMEOUT", 5))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+
 class AuthError(Exception):
     def __init__(self, error, status_code):
         self.error = error
         self.status_code = status_code
 
+class KeyCache:
+    """Process-wide cache of JWKS signing keys and already verified tokens.
+
+    Keys are constructed once per ``kid`` and kept for ``ttl`` seconds. A token
+    signed with an unknown ``kid`` triggers a refresh, but at most one refresh
+    runs at a time and refreshes are spaced at least ``min_refresh_interval``
+    seconds apart, so a flood of bad tokens cannot hammer the JWKS endpoint.
+    A failed fetch is not retried within that interval either: cached keys
+    keep being served, and with none cached requests fail fast with a 503.
+    Verified token payloads are held in a bounded LRU until their ``exp``.
+    """
+
+    def __init__(self, jwks_url, ttl=JWKS_CACHE_TTL, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 token_cache_size=TOKEN_CACHE_SIZE, fetch_timeout=JWKS_FETCH_TIMEOUT):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.token_cache_size = token_cache_size
+        self.fetch_timeout = fetch_timeout
+
+        self._keys = {}
+        self._expires_at = 0.0
+        self._last_refresh = 0.0
+        self._fetch_failed = False
+        self._refresh_lock = threading.Lock()
+
+        self._tokens = OrderedDict()
+        self._tokens_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "key_hits": 0,
+            "key_misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "token_hits": 0,
+            "token_misses": 0,
+        }
+
+    def _incr(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["keys"] = len(self._keys)
+        stats["tokens"] = len(self._tokens)
+        return stats
+
+    def clear(self):
+        with self._refresh_lock:
+            self._keys = {}
+            self._expires_at = 0.0
+            self._last_refresh = 0.0
+            self._fetch_failed = False
+        with self._tokens_lock:
+            self._tokens.clear()
+
+    def _fetch_jwks(self):
+        with urlopen(self.jwks_url, timeout=self.fetch_timeout) as response:
+            return json.loads(response.read())
+
+    def _refresh(self, force=False):
+        """Reload the key set. Concurrent callers share a single fetch."""
+        stale_keys = self._keys
+        with self._refresh_lock:
+            # Another thread refreshed while we were waiting for the lock
+            if self._keys is not stale_keys:
+                return
+            now = time.monotonic()
+            # ... or tried and failed, and set a back-off we must not retry through
+            if not force and now < self._expires_at:
+                return
+            if force and now - self._last_refresh < self.min_refresh_interval:
+                return
+
+            self._last_refresh = now
+            try:
+                jwks = self._fetch_jwks()
+            except Exception:
+                self._incr("refresh_errors")
+                # Keep serving the keys we have rather than failing every request. Without
+                # any keys the failure itself is cached for the same window, so requests
+                # fail fast instead of each waiting on another fetch.
+                self._expires_at = now + self.min_refresh_interval
+                self._fetch_failed = True
+                return
+
+            keys = {}
+            for key in jwks.get("keys", []):
+                if "kid" not in key:
+                    continue
+                keys[key["kid"]] = jwk.construct(key, algorithm=key.get("alg", ALGORITHMS[0]))
+
+            self._keys = keys
+            self._expires_at = now + self.ttl
+            self._fetch_failed = False
+            self._incr("refreshes")
+
+    def get_key(self, kid):
+        if time.monotonic() >= self._expires_at:
+            self._refresh()
+        if not self._keys and self._fetch_failed:
+            raise AuthError({"code": "jwks_unavailable", "description": "Unable to fetch signing keys"}, 503)
+
+        key = self._keys.get(kid)
+        if key is not None:
+            self._incr("key_hits")
+            return key
+
+        # Unknown kid, the tenant may have rotated its signing keys
+        self._incr("key_misses")
+        self._refresh(force=True)
+        return self._keys.get(kid)
+
+    def get_token(self, token):
+        with self._tokens_lock:
+            entry = self._tokens.get(token)
+            if entry is not None:
+                payload, expires_at = entry
+                if time.time() < expires_at:
+                    self._tokens.move_to_end(token)
+                    self._incr("token_hits")
+                    return payload
+                del self._tokens[token]
+        self._incr("token_misses")
+        return None
+
+    def put_token(self, token, payload):
+        if self.token_cache_size <= 0 or "exp" not in payload:
+            return
+        with self._tokens_lock:
+            self._tokens[token] = (payload, float(payload["exp"]))
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.token_cache_size:
+                self._tokens.popitem(last=False)
+
+key_cache = KeyCache(JWKS_URL)
+
+def get_auth_cache_stats():
+    """Hit/miss/refresh counters for the JWKS key and verified token caches"""
+    return key_cache.stats()
+
 def get_token_auth_header():
     """Obtains the Access Token from the Authorization Header"""
     auth = request.headers.get("Authorization", None)
@@ -32,29 +189,36 @@ def get_token_auth_header():
     token = parts[1]
     return token
 
+def verify_token(token):
+    """Validates the token against the cached JWKS and returns its payload"""
+    payload = key_cache.get_token(token)
+    if payload is not None:
+        return payload
+
+    unverified_header = jwt.get_unverified_header(token)
+    rsa_key = key_cache.get_key(unverified_header["kid"])
+
+    if not rsa_key:
+        raise AuthError({"code": "invalid_header", "description": "Unable to find appropriate key"}, 401)
+
+    payload = jwt.decode(
+        token,
+        rsa_key,
+        algorithms=ALGORITHMS,
+        audience=API_IDENTIFIER,
+        issuer=f"https://{AUTH0_DOMAIN}/"
+    )
+
+    key_cache.put_token(token, payload)
+    return payload
+
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         try:
-            token = get_token_auth_header()
-            jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-            jwks = json.loads(jsonurl.read())
-            
-            unverified_header = jwt.get_unverified_header(token)
-            rsa_key = next((key for key in jwks["keys"] if key["kid"] == unverified_header["kid"]), None)
-
-            if not rsa_key:
-                raise AuthError({"code": "invalid_header", "description": "Unable to find appropriate key"}, 401)
-            
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_IDENTIFIER,
-                issuer=f"https://{AUTH0_DOMAIN}/"
-            )
-
-            request.auth_payload = payload
+            with stage('auth'):
+                token = get_token_auth_header()
+                request.auth_payload = verify_token(token)
         except AuthError as e:
             response = jsonify(e.error)
             response.status_code = e.status_code
@@ -74,4 +238,3 @@ def requires_auth(f):
 
         return f(*args, **kwargs)
     return decorated
-
@@ -13,12 +13,26 @@ import axios from 'axios';
 import './App.css'; // Assuming you have a separate CSS file for the App component if needed
 import './index.css'; // Make sure this is imported
 
+const API_BASE_URL = process.env.REACT_APP_API_BASE_URL;
+// Number of multipart parts sent to S3 at the same time
+const PART_UPLOAD_CONCURRENCY = 4;
+// Files up to this size are hashed in the browser so stored content is never sent twice
+const HASH_SIZE_LIMIT = 64 * 1024 * 1024;
+
+const sha256Hex = async (blob) => {
+  const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+};
+
 const App = () => {
   const { isAuthenticated, loginWithRedirect, logout, getAccessTokenSilently } =
     useAuth0();
   const [file, setFile] = useState(null);
   const [uploadStatus, setUploadStatus] = useState('');
   const [isUploading, setIsUploading] = useState(false);
+  const [uploadProgress, setUploadProgress] = useState(0);
 
   const handleLogin = () => {
     loginWithRedirect();
@@ -46,6 +60,7 @@ const App = () => {
     }
 
     setIsUploading(true);
+    setUploadProgress(0);
     setUploadStatus('Uploading...');
 
     try {
@@ -53,33 +68,104 @@ const App = () => {
       const accessToken = await getAccessTokenSilently({
         audience: process.env.REACT_APP_AUTH0_API_IDENTIFIER,
       });
+      const authHeaders = { Authorization: `Bearer ${accessToken}` };
 
-      const formData = new FormData();
-      formData.append('file', file);
+      // If the server already has this content the file is created without uploading it
+      const sha256 = file.size <= HASH_SIZE_LIMIT ? await sha256Hex(file) : undefined;
+      if (sha256) {
+        const { data: check } = await axios.post(
+          `${API_BASE_URL}/api/upload/check`,
+          { sha256, filename: file.name },
+          { headers: authHeaders }
+        );
+        if (check.exists) {
+          setUploadProgress(100);
+          setUploadStatus(check.message || 'Upload successful!');
+          return;
+        }
+      }
 
-      // Make the API call to your Flask backend
-      const response = await axios.post(
-        `${process.env.REACT_APP_API_BASE_URL}/api/upload`,
-        formData,
+      // Ask the backend where to put the file; the bytes go straight to S3
+      const { data: presign } = await axios.post(
+        `${API_BASE_URL}/api/upload/presign`,
         {
+          filename: file.name,
+          size: file.size,
+          content_type: file.type || undefined,
+          sha256,
+        },
+        { headers: authHeaders }
+      );
+
+      const completion = { key: presign.key, filename: file.name, sha256 };
+      if (presign.url) {
+        await axios.put(presign.url, file, {
           headers: {
-            'Content-Type': 'multipart/form-data',
-            Authorization: `Bearer ${accessToken}`, // Send the access token
+            ...presign.headers,
+            ...(file.type ? { 'Content-Type': file.type } : {}),
           },
-        }
+          onUploadProgress: (event) => setUploadProgress(Math.round((event.loaded / file.size) * 100)),
+        });
+      } else {
+        completion.upload_id = presign.upload_id;
+        completion.parts = await uploadParts(file, presign);
+      }
+
+      const response = await axios.post(
+        `${API_BASE_URL}/api/upload/complete`,
+        completion,
+        { headers: authHeaders }
       );
 
+      setUploadProgress(100);
       setUploadStatus(response.data.message || 'Upload successful!');
     } catch (error) {
       console.error('File upload failed:', error);
       setUploadStatus(
-        `Upload failed: ${error.response?.data?.message || error.message}`
+        `Upload failed: ${error.response?.data?.error || error.response?.data?.message || error.message}`
       );
     } finally {
       setIsUploading(false);
     }
   };
 
+  const uploadParts = async (file, presign) => {
+    const loaded = new Array(presign.parts.length).fill(0);
+    const completed = [];
+    const queue = [...presign.parts];
+
+    const reportProgress = () => {
+      const total = loaded.reduce((sum, bytes) => sum + bytes, 0);
+      setUploadProgress(Math.round((total / file.size) * 100));
+    };
+
+    // A few workers pull parts off the queue so parts upload in parallel
+    const worker = async () => {
+      while (queue.length > 0) {
+        const part = queue.shift();
+        const index = part.part_number - 1;
+        const blob = file.slice(index * presign.part_size, (index + 1) * presign.part_size);
+        const response = await axios.put(part.url, blob, {
+          onUploadProgress: (event) => {
+            loaded[index] = event.loaded;
+            reportProgress();
+          },
+        });
+        loaded[index] = blob.size;
+        reportProgress();
+        // The bucket CORS policy must expose the ETag header
+        completed.push({ part_number: part.part_number, etag: response.headers.etag });
+      }
+    };
+
+    const workers = Array.from(
+      { length: Math.min(PART_UPLOAD_CONCURRENCY, presign.parts.length) },
+      worker
+    );
+    await Promise.all(workers);
+    return completed;
+  };
+
   const getStatusClasses = () => {
     if (uploadStatus.includes('failed') || uploadStatus.includes('No file selected')) {
       return 'status-message red';
@@ -185,7 +271,7 @@ const App = () => {
                 {isUploading ? (
                   <>
                     <Loader2 className="spinner" style={{marginRight: '0.5rem'}} size={20} />
-                    Uploading...
+                    Uploading... {uploadProgress}%
                   </>
                 ) : (
                   <>
@@ -196,6 +282,12 @@ const App = () => {
               </button>
             </form>
 
+            {isUploading && (
+              <div style={{marginTop: '1rem', width: '100%', height: '0.5rem', backgroundColor: '#e5e7eb', borderRadius: '9999px', overflow: 'hidden'}}>
+                <div style={{width: `${uploadProgress}%`, height: '100%', backgroundColor: '#3b82f6', transition: 'width 0.2s'}} />
+              </div>
+            )}
+
             {uploadStatus && (
               <div
                 className={getStatusClasses()}